@@ -0,0 +1,119 @@
+"""
+End-to-end crawl throughput against the local mock GraphQL server (see `benchmarks.server`).
+
+Drives `Scraper` (UserTweets, Followers), `Search` and `Account._paginate` at several concurrency
+levels and reports pages/sec, p50/p99 request latency and peak RSS. Each run happens in a fresh
+process so peak RSS is per run.
+
+    python -m benchmarks.crawl [--levels 1,4,16,64] [--pages 10] [--latency 0.02] [--rate-limit-every 0]
+"""
+import argparse
+import asyncio
+import multiprocessing as mp
+import resource
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from httpx import Client
+
+from benchmarks.server import MockGraphQL
+from twitter.metrics import Metrics
+
+TARGETS = ('scraper-tweets', 'scraper-followers', 'search', 'account')
+
+
+class Recorder(Metrics):
+    """ Keeps every latency sample, the histogram buckets are too coarse for p50/p99 """
+
+    def __init__(self):
+        super().__init__()
+        self.samples = []
+
+    def observe(self, name, r, elapsed):
+        super().observe(name, r, elapsed)
+        self.samples.append(elapsed)
+
+
+def session() -> Client:
+    return Client(cookies={'ct0': 'bench', 'auth_token': 'bench'})
+
+
+def crawl(target: str, url: str, concurrency: int, metrics: Recorder):
+    if target.startswith('scraper'):
+        from twitter.constants import Operation
+        from twitter.ratelimit import RateLimiter
+        from twitter.scraper import Scraper
+
+        s = Scraper(session=session(), gql_api=url, save=False, pbar=False, metrics=metrics)
+        s.rate_limiter = RateLimiter(limit=10 ** 9)  # the mock server does not need pacing
+        operation = Operation.UserTweets if target == 'scraper-tweets' else Operation.Followers
+
+        async def run():
+            async for _ in s.aiter(operation, list(range(1, concurrency + 1)), concurrency=concurrency):
+                ...
+            await s.aclose()
+
+        asyncio.run(run())
+
+    elif target == 'search':
+        from twitter.search import Search
+
+        s = Search(session=session(), gql_api=url, save=False, metrics=metrics)
+        s.run([{'category': 'Latest', 'query': f'bitcoin {i}'} for i in range(concurrency)])
+        s.close()
+
+    elif target == 'account':
+        from twitter.account import Account
+        from twitter.constants import Operation
+
+        account = Account(session=session(), gql_api=url, metrics=metrics)
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(lambda i: account._paginate('GET', Operation.Bookmarks, {'bench': i}, float('inf')),
+                          range(concurrency)))
+
+
+def worker(target: str, url: str, concurrency: int, out: mp.Queue):
+    metrics = Recorder()
+    start = time.perf_counter()
+    crawl(target, url, concurrency, metrics)
+    elapsed = time.perf_counter() - start
+    samples = sorted(metrics.samples) or [0]
+    snapshot = metrics.snapshot()['operations']
+    out.put({
+        'pages': sum(m['pages'] for m in snapshot.values()),
+        'requests': len(metrics.samples),
+        'rate_limited': sum(m['status'].get('4xx', 0) for m in snapshot.values()),
+        'seconds': elapsed,
+        'p50': samples[len(samples) // 2],
+        'p99': samples[min(len(samples) - 1, int(len(samples) * .99))],
+        'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,  # KB on linux
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', default='data/search_results')
+    parser.add_argument('--targets', default=','.join(TARGETS))
+    parser.add_argument('--levels', default='1,4,16,64')
+    parser.add_argument('--pages', type=int, default=10, help='pages per query')
+    parser.add_argument('--latency', type=float, default=.02, help='seconds added to every response')
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='return a 429 for every n-th request')
+    args = parser.parse_args()
+
+    ctx = mp.get_context('fork')
+    with MockGraphQL(args.dir, args.pages, args.latency, args.rate_limit_every) as mock:
+        print(f'mock server: {mock.url}, {args.pages} pages/query, {args.latency * 1e3:.0f} ms latency\n')
+        print(f'{"target":<18} {"conc":>5} {"pages":>7} {"429s":>5} {"pages/s":>9} {"p50 ms":>8} {"p99 ms":>8} {"rss MB":>8}')
+        for target in args.targets.split(','):
+            for level in map(int, args.levels.split(',')):
+                q = ctx.Queue()
+                p = ctx.Process(target=worker, args=(target, mock.url, level, q))
+                p.start()
+                r = q.get()
+                p.join()
+                print(f'{target:<18} {level:>5} {r["pages"]:>7} {r["rate_limited"]:>5} {r["pages"] / r["seconds"]:>9.1f} '
+                      f'{r["p50"] * 1e3:>8.1f} {r["p99"] * 1e3:>8.1f} {r["rss"]:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
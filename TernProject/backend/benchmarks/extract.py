@@ -0,0 +1,90 @@
+"""
+Benchmark key extraction on the stored `data/search_results` payloads.
+
+Compares the previous recursive `find_key` (one walk per key) against a single `find_keys` pass,
+and against `find_keys` with compiled paths for the known entry schema.
+
+    python -m benchmarks.extract [--dir data/search_results] [--repeat 5]
+"""
+import argparse
+import time
+from pathlib import Path
+
+import orjson
+
+from twitter.util import find_keys
+
+KEYS = ('entryId', 'rest_id', 'content')
+
+# stored pages are lists of timeline entries
+PATHS = {
+    'entryId': '*.entryId',
+    'rest_id': '*.content.itemContent.tweet_results.result.rest_id',
+    'content': '*.content',
+}
+
+
+def find_key_recursive(obj: any, key: str) -> list:
+    """ Previous implementation of `util.find_key`, kept as the baseline """
+
+    def helper(obj: any, key: str, L: list) -> list:
+        if not obj:
+            return L
+
+        if isinstance(obj, list):
+            for e in obj:
+                L.extend(helper(e, key, []))
+            return L
+
+        if isinstance(obj, dict) and obj.get(key):
+            L.append(obj[key])
+
+        if isinstance(obj, dict) and obj:
+            for k in obj:
+                L.extend(helper(obj[k], key, []))
+        return L
+
+    return helper(obj, key, [])
+
+
+def bench(fn, pages: list, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for page in pages:
+            fn(page)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', default='data/search_results')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    pages = [orjson.loads(p.read_bytes()) for p in sorted(Path(args.dir).glob('*.json'))]
+    if not pages:
+        raise SystemExit(f'No payloads found in {args.dir}')
+
+    # sanity check, the single pass must match the baseline exactly
+    for page in pages:
+        found = find_keys(page, *KEYS)
+        assert all(found[k] == find_key_recursive(page, k) for k in KEYS)
+
+    cases = {
+        'find_key x3 (recursive)': lambda page: [find_key_recursive(page, k) for k in KEYS],
+        'find_keys (single pass)': lambda page: find_keys(page, *KEYS),
+        'find_keys (compiled paths)': lambda page: find_keys(page, *KEYS, paths=PATHS),
+    }
+    size = sum(len(orjson.dumps(p)) for p in pages)
+    print(f'{len(pages)} pages, {size / 1e6:.2f} MB, keys: {", ".join(KEYS)}\n')
+    baseline = None
+    for name, fn in cases.items():
+        t = bench(fn, pages, args.repeat)
+        baseline = baseline or t
+        print(f'{name:<28} {t * 1e3:8.2f} ms total  {t / len(pages) * 1e6:8.1f} us/page  {baseline / t:5.2f}x')
+
+
+if __name__ == '__main__':
+    main()
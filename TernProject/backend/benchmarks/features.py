@@ -0,0 +1,142 @@
+"""
+Response size and parse time per feature profile (see `twitter.constants.FEATURE_PROFILES`).
+
+Live, with a logged-in session, each query is sent once per profile and the response bytes and
+orjson parse time are compared:
+
+    python -m benchmarks.features --cookies cookies.json [--user elonmusk] [--search bitcoin]
+
+Offline (no session), the stored search results in `data/search_results` are pruned of the fields
+gated by the flags each profile disables (`FLAG_FIELDS`). Fields whose flag is unknown stay in, so
+this is a lower bound on the saving:
+
+    python -m benchmarks.features [--dir data/search_results]
+"""
+import argparse
+import time
+from pathlib import Path
+
+import orjson
+
+from twitter.constants import FEATURE_PROFILES, Operation
+
+# fields of a tweet result (or of its author with `user.`) that are only returned when the flag is on
+FLAG_FIELDS = {
+    'view_counts_everywhere_api_enabled': ('views',),
+    'responsive_web_edit_tweet_api_enabled': ('edit_control', 'edit_perspective', 'previous_counts'),
+    'graphql_is_translatable_rweb_tweet_is_translatable_enabled': ('is_translatable',),
+    'longform_notetweets_rich_text_read_enabled': ('note_tweet.note_tweet_results.result.richtext',),
+    'longform_notetweets_inline_media_enabled': ('note_tweet.note_tweet_results.result.media',),
+    'responsive_web_twitter_article_tweet_consumption_enabled': ('article',),
+    'responsive_web_birdwatch_note_limit_enabled': ('birdwatch_pivot',),
+    'c9s_tweet_anatomy_moderator_badge_enabled': ('author_community_relationship',),
+    'blue_business_profile_image_shape_enabled': ('user.profile_image_shape',),
+    'subscriptions_verification_info_verified_since_enabled': ('user.verification_info',),
+    'highlights_tweets_tab_ui_enabled': ('user.highlights_info',),
+}
+
+
+def drop(obj: dict, path: str):
+    *parents, key = path.split('.')
+    for p in parents:
+        if not isinstance(obj := obj.get(p), dict):
+            return
+    obj.pop(key, None)
+
+
+def prune(tweet: dict, fields: list[str]):
+    """ Remove `fields` from a tweet result, its author and any quoted tweet """
+    if 'tweet' in tweet:  # TweetWithVisibilityResults
+        tweet = tweet['tweet']
+    user = tweet.get('core', {}).get('user_results', {}).get('result', {})
+    for f in fields:
+        drop(user, f[5:]) if f.startswith('user.') else drop(tweet, f)
+    if quoted := tweet.get('quoted_status_result', {}).get('result'):
+        prune(quoted, fields)
+
+
+def parse_time(pages: list[bytes], runs: int = 5) -> float:
+    best = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        for p in pages:
+            orjson.loads(p)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def report(rows: list[tuple[str, str, int, float]]):
+    print(f'{"query":<24} {"profile":<10} {"KB":>10} {"saved":>7} {"parse ms":>9}')
+    full = {}
+    for query, profile, size, t in rows:
+        full.setdefault(query, size)
+        print(f'{query:<24} {profile:<10} {size / 1024:>10.1f} {1 - size / full[query]:>7.1%} {t * 1e3:>9.2f}')
+
+
+def offline(path: Path):
+    pages = [orjson.loads(p.read_bytes()) for p in sorted(path.glob('*.json'))]
+    if not pages:
+        raise SystemExit(f'No stored search results found in {path}')
+    rows = []
+    for name, overrides in FEATURE_PROFILES.items():
+        fields = [f for flag, v in overrides.items() if v is False for f in FLAG_FIELDS.get(flag, ())]
+        out = []
+        for entries in orjson.loads(orjson.dumps(pages)):  # deep copy
+            for e in entries:
+                try:
+                    prune(e['content']['itemContent']['tweet_results']['result'], fields)
+                except (KeyError, TypeError):
+                    ...
+            out.append(orjson.dumps(entries))
+        rows.append((f'SearchTimeline x{len(out)}', name, sum(map(len, out)), parse_time(out)))
+    report(rows)
+
+
+def live(cookies: str, user: str, query: str):
+    from httpx import Client
+    from twitter.scraper import Scraper
+    from twitter.search import Search
+    from twitter.util import find_key
+
+    session = Client(cookies=orjson.loads(Path(cookies).read_bytes()))
+    scraper = Scraper(session=session, save=False, pbar=False, coalesce=False)
+    search = Search(session=session, save=False, coalesce=False)
+    rows = []
+    try:
+        for name in FEATURE_PROFILES:
+            scraper.features = search.features = name
+            user_data = scraper.users([user])
+            user_id = find_key(user_data, 'rest_id')[0]
+            tweets = scraper.tweets([user_id], limit=20)
+            ids = [e['entryId'][6:] for x in find_key(tweets, 'entries') for e in x if e['entryId'].startswith('tweet-')][:20]
+            for label, data in (
+                    (f'UserByScreenName {user}', user_data),
+                    (f'UserTweets {user}', tweets),
+                    (f'TweetResultsByRestIds x{len(ids)}', scraper.tweets_by_ids(ids)),
+                    (f'SearchTimeline {query}', search.run([{'category': 'Latest', 'query': query}], limit=20)),
+            ):
+                pages = [orjson.dumps(d) for d in data]
+                rows.append((label, name, sum(map(len, pages)), parse_time(pages)))
+    finally:
+        scraper.close()
+        search.close()
+    rows.sort(key=lambda r: r[0])  # stable, keeps `full` first within each query
+    report(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', default='data/search_results')
+    parser.add_argument('--cookies', help='JSON file with ct0 and auth_token, enables live mode')
+    parser.add_argument('--user', default='elonmusk')
+    parser.add_argument('--search', default='bitcoin')
+    args = parser.parse_args()
+    print(f'{len(Operation.default_features)} feature flags, profiles: {", ".join(FEATURE_PROFILES)}\n')
+    if args.cookies:
+        live(args.cookies, args.user, args.search)
+    else:
+        offline(Path(args.dir))
+
+
+if __name__ == '__main__':
+    main()
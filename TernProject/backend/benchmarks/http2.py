@@ -0,0 +1,85 @@
+"""
+HTTP/1.1 connection-per-request vs. multiplexed HTTP/2 for GraphQL traffic, against the local mock server.
+
+Each mode runs `Scraper` (UserTweets) at several concurrency levels in a fresh process and reports
+handshakes (TCP connects and HTTP/2 connection inits from httpcore trace events, plus connections
+accepted by the server), pages/sec and p50/p99 latency. The mock server is cleartext, so HTTP/2 uses
+prior knowledge and there are no TLS handshakes here; against twitter.com each TCP connect is also
+a TLS handshake.
+
+    python -m benchmarks.http2 [--levels 1,16,64,256] [--connections 2] [--streams 100] [--latency 0.05]
+"""
+import argparse
+import asyncio
+import multiprocessing as mp
+import time
+
+from benchmarks.crawl import Recorder, session
+from benchmarks.server import H2Server, MockGraphQL
+
+MODES = ('http1', 'http2', 'http2-warm')
+
+
+def worker(mode: str, url: str, concurrency: int, connections: int, streams: int, out: mp.Queue):
+    from twitter.constants import Operation
+    from twitter.ratelimit import RateLimiter
+    from twitter.scraper import Scraper
+
+    metrics = Recorder()
+    kwargs = {'http2': False} if mode == 'http1' else {'http2': True, 'http1': False, 'connections': connections, 'streams': streams}
+    s = Scraper(session=session(), gql_api=url, save=False, pbar=False, metrics=metrics, **kwargs)
+    s.rate_limiter = RateLimiter(limit=10 ** 9)
+
+    async def run():
+        if mode == 'http2-warm':
+            await s.awarmup()
+        start = time.perf_counter()
+        async for _ in s.aiter(Operation.UserTweets, list(range(1, concurrency + 1)), concurrency=concurrency):
+            ...
+        elapsed = time.perf_counter() - start
+        stats = dict(s.transport.stats)
+        await s.aclose()
+        return elapsed, stats
+
+    elapsed, stats = asyncio.run(run())
+    samples = sorted(metrics.samples) or [0]
+    out.put({
+        'pages': sum(m['pages'] for m in metrics.snapshot()['operations'].values()),
+        'seconds': elapsed,
+        'p50': samples[len(samples) // 2],
+        'p99': samples[min(len(samples) - 1, int(len(samples) * .99))],
+        **stats,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', default='data/search_results')
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--levels', default='1,16,64,256')
+    parser.add_argument('--pages', type=int, default=5, help='pages per query')
+    parser.add_argument('--latency', type=float, default=.05, help='seconds added to every response')
+    parser.add_argument('--connections', type=int, default=2, help='HTTP/2 connections')
+    parser.add_argument('--streams', type=int, default=100, help='streams per HTTP/2 connection')
+    args = parser.parse_args()
+
+    ctx = mp.get_context('fork')
+    with MockGraphQL(args.dir, args.pages, args.latency) as mock, H2Server(mock) as h2:
+        print(f'{args.pages} pages/query, {args.latency * 1e3:.0f} ms latency, '
+              f'HTTP/2: {args.connections} connections x {args.streams} streams\n')
+        print(f'{"mode":<11} {"conc":>5} {"pages":>6} {"tcp":>5} {"h2":>4} {"server":>7} {"pages/s":>8} {"p50 ms":>7} {"p99 ms":>7}')
+        for mode in args.modes.split(','):
+            for level in map(int, args.levels.split(',')):
+                before = mock.connections
+                q = ctx.Queue()
+                p = ctx.Process(target=worker, args=(mode, mock.url if mode == 'http1' else h2.url, level,
+                                                     args.connections, args.streams, q))
+                p.start()
+                r = q.get()
+                p.join()
+                print(f'{mode:<11} {level:>5} {r["pages"]:>6} {r["tcp"]:>5} {r["http2"]:>4} {mock.connections - before:>7} '
+                      f'{r["pages"] / r["seconds"]:>8.1f} {r["p50"] * 1e3:>7.1f} {r["p99"] * 1e3:>7.1f}')
+
+
+if __name__ == '__main__':
+    main()
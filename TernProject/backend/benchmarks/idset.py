@@ -0,0 +1,79 @@
+"""
+Memory and speed of the id sets used to dedupe pagination results.
+
+Compares the previous `set` of `rest_id` strings with a `set` of ints and `twitter.ids.IdSet`, adding
+snowflake-like ids one page (20 ids) at a time with a share of duplicates, as a long timeline or
+follower list would. Memory is measured with tracemalloc (live bytes after the last page, and peak),
+time in a separate untraced run.
+
+    python -m benchmarks.idset [--sizes 100000,1000000] [--dups 0.1]
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+import orjson
+
+from twitter.ids import IdSet
+
+PAGE = 20
+
+
+def pages(n: int, dups: float, seed: int = 0) -> list[bytes]:
+    """ Pages of `rest_id` strings as JSON, so every run parses its own strings like `_paginate` does """
+    rng = random.Random(seed)
+    base = 1_700_000_000_000_000_000
+    ids = [base + rng.getrandbits(52) for _ in range(n)]
+    out = []
+    for i in range(0, n, PAGE):
+        page = ids[i:i + PAGE]
+        if i and dups:  # re-served results from earlier pages
+            page += [ids[rng.randrange(i)] for _ in range(int(PAGE * dups))]
+        out.append(orjson.dumps([str(x) for x in page]))
+    return out
+
+
+def fill(kind: str, data: list[bytes]):
+    if kind == 'set[str]':
+        ids = set()
+        for page in data:
+            ids |= set(orjson.loads(page))
+    elif kind == 'set[int]':
+        ids = set()
+        for page in data:
+            ids |= {int(x) for x in orjson.loads(page)}
+    else:
+        ids = IdSet()
+        for page in data:
+            ids.update(int(x) for x in orjson.loads(page))
+    return ids
+
+
+def run(kind: str, data: list[bytes]) -> tuple[int, int, int, float]:
+    start = time.perf_counter()
+    fill(kind, data)
+    elapsed = time.perf_counter() - start  # timed separately, tracemalloc slows down allocations
+    tracemalloc.start()
+    ids = fill(kind, data)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(ids), current, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='100000,1000000')
+    parser.add_argument('--dups', type=float, default=.1, help='duplicates per page, as a share of the page size')
+    args = parser.parse_args()
+
+    print(f'{"ids":>9} {"kind":<9} {"unique":>9} {"MB":>8} {"peak MB":>8} {"B/id":>6} {"s":>6}')
+    for n in map(int, args.sizes.split(',')):
+        data = pages(n, args.dups)
+        for kind in ('set[str]', 'set[int]', 'IdSet'):
+            unique, current, peak, elapsed = run(kind, data)
+            print(f'{n:>9} {kind:<9} {unique:>9} {current / 1e6:>8.1f} {peak / 1e6:>8.1f} {current / unique:>6.1f} {elapsed:>6.2f}')
+
+
+if __name__ == '__main__':
+    main()
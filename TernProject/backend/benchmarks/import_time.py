@@ -0,0 +1,56 @@
+"""
+Cold import time of the twitter package, each sample in a fresh interpreter.
+
+Reports the median wall time of `import <module>` and, from `python -X importtime`, the modules it
+pulls in directly, slowest first. Third-party modules that are already imported by the interpreter
+at startup (e.g. via `site`) are not counted.
+
+    python -m benchmarks.import_time [--modules twitter.search,twitter.scraper] [--runs 15] [--top 12]
+"""
+import argparse
+import re
+import statistics
+import subprocess
+import sys
+
+MODULES = ('twitter.search', 'twitter.scraper', 'twitter.account')
+
+
+def wall(module: str) -> float:
+    code = f'import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)'
+    return float(subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout)
+
+
+def breakdown(module: str) -> list[tuple[str, int]]:
+    """ (module, cumulative us) for everything imported directly by `module`'s import statement """
+    r = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True)
+    res = []
+    for line in r.stderr.splitlines():
+        if m := re.match(r'import time:\s+\d+ \|\s+(\d+) \|( +)(\S+)$', line):
+            cumulative, indent, name = m.groups()
+            if len(indent) <= 3:  # top level, or imported directly by a top-level module
+                res.append((name, int(cumulative)))
+    # modules imported before `module` belong to interpreter startup
+    names = [n for n, _ in res]
+    start = names.index(module.split('.')[0]) if module.split('.')[0] in names else 0
+    return sorted(res[start:], key=lambda x: -x[1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', default=','.join(MODULES))
+    parser.add_argument('--runs', type=int, default=15)
+    parser.add_argument('--top', type=int, default=12)
+    args = parser.parse_args()
+
+    for module in args.modules.split(','):
+        samples = [wall(module) for _ in range(args.runs)]
+        print(f'{module}: median {statistics.median(samples) * 1e3:.1f} ms, '
+              f'min {min(samples) * 1e3:.1f} ms over {args.runs} runs')
+        for name, us in breakdown(module)[:args.top]:
+            print(f'    {us / 1e3:8.1f} ms  {name}')
+        print()
+
+
+if __name__ == '__main__':
+    main()
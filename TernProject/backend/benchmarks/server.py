@@ -0,0 +1,313 @@
+"""
+Local stand-in for the GraphQL API, serving recorded pages.
+
+Pages are built from the entries stored in `data/search_results`: tweets for `SearchTimeline`,
+`UserTweets` and `TweetDetail`, and the authors of those tweets for `Followers`/`Following`.
+Cursors are synthetic (the page number), latency and 429s can be injected. `H2Server` serves the
+same pages over cleartext HTTP/2.
+
+    python -m benchmarks.server [--port 8000] [--latency 0.05] [--rate-limit-every 100]
+
+Then point a client at it with `gql_api='http://127.0.0.1:8000/i/api/graphql'`.
+"""
+import argparse
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import orjson
+
+from twitter.util import LazyImport
+
+h2 = LazyImport('h2')  # only needed by `H2Server`
+
+PAGE_SIZE = 20
+
+# where each operation keeps its timeline, mirrors the real response schema
+TIMELINES = {
+    'SearchTimeline': lambda t: {'search_by_raw_query': {'search_timeline': {'timeline': t}}},
+    'UserTweets': lambda t: {'user': {'result': {'timeline_v2': {'timeline': t}}}},
+    'UserTweetsAndReplies': lambda t: {'user': {'result': {'timeline_v2': {'timeline': t}}}},
+    'UserMedia': lambda t: {'user': {'result': {'timeline_v2': {'timeline': t}}}},
+    'Likes': lambda t: {'user': {'result': {'timeline_v2': {'timeline': t}}}},
+    'Followers': lambda t: {'user': {'result': {'timeline': {'timeline': t}}}},
+    'Following': lambda t: {'user': {'result': {'timeline': {'timeline': t}}}},
+    'Favoriters': lambda t: {'favoriters_timeline': {'timeline': t}},
+    'Retweeters': lambda t: {'retweeters_timeline': {'timeline': t}},
+    'TweetDetail': lambda t: {'threaded_conversation_with_injections_v2': t},
+}
+USER_TIMELINES = {'Followers', 'Following', 'Favoriters', 'Retweeters'}
+
+
+def load_entries(path: str | Path) -> tuple[list[dict], list[dict]]:
+    """ Tweet entries and user entries (the tweets' authors) from stored search results """
+    tweets, users = {}, {}
+    for p in sorted(Path(path).glob('*.json')):
+        for e in orjson.loads(p.read_bytes()):
+            if not e.get('entryId', '').startswith('tweet-'):
+                continue
+            e.pop('query', None)
+            tweets[e['entryId']] = e
+            try:
+                user = e['content']['itemContent']['tweet_results']['result']['core']['user_results']['result']
+            except (KeyError, TypeError):
+                continue
+            users[user['rest_id']] = {
+                'entryId': f'user-{user["rest_id"]}',
+                'sortIndex': user['rest_id'],
+                'content': {
+                    'entryType': 'TimelineTimelineItem',
+                    '__typename': 'TimelineTimelineItem',
+                    'itemContent': {
+                        'itemType': 'TimelineUser',
+                        '__typename': 'TimelineUser',
+                        'user_results': {'result': user},
+                        'userDisplayType': 'User',
+                    },
+                },
+            }
+    return list(tweets.values()), list(users.values())
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # the default backlog of 5 drops connections under load
+
+
+def cursor_entry(kind: str, value: str) -> dict:
+    return {
+        'entryId': f'cursor-{kind.lower()}-{value}',
+        'sortIndex': value,
+        'content': {
+            'entryType': 'TimelineTimelineCursor',
+            '__typename': 'TimelineTimelineCursor',
+            'value': value,
+            'cursorType': kind,
+        },
+    }
+
+
+class MockGraphQL:
+    """
+    @param path: directory of stored search results
+    @param pages: number of pages per query before the timeline ends
+    @param latency: seconds added to every response
+    @param rate_limit_every: return a 429 for every n-th request, 0 to disable
+    """
+
+    def __init__(self, path: str | Path = 'data/search_results', pages: int = 20, latency: float = 0,
+                 rate_limit_every: int = 0, host: str = '127.0.0.1', port: int = 0):
+        self.tweets, self.users = load_entries(path)
+        if not self.tweets:
+            raise SystemExit(f'No stored search results found in {path}')
+        self.pages = pages
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.requests = 0
+        self.connections = 0  # accepted by the server, over HTTP/1.1 and HTTP/2
+        self.lock = threading.Lock()
+        self.server = Server((host, port), self._handler())
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/i/api/graphql'
+
+    def start(self) -> 'MockGraphQL':
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def page(self, name: str, variables: dict) -> dict:
+        n = int(variables.get('cursor') or 0)
+        # offset each query so concurrent queries return different ids
+        seed = sum(map(ord, orjson.dumps({k: v for k, v in variables.items() if k != 'cursor'}).decode()))
+        pool = self.users if name in USER_TIMELINES else self.tweets
+        entries = []
+        if n < self.pages:
+            start = (seed * self.pages + n) * PAGE_SIZE
+            entries = [pool[(start + i) % len(pool)] for i in range(PAGE_SIZE)]
+            entries += [cursor_entry('Top', f'{n}'), cursor_entry('Bottom', f'{n + 1}')]
+        elif name == 'SearchTimeline':
+            entries = [cursor_entry('Top', f'{n}'), cursor_entry('Bottom', f'{n + 1}')]
+        timeline = {'instructions': [{'type': 'TimelineAddEntries', 'entries': entries}]}
+        return {'data': TIMELINES.get(name, TIMELINES['UserTweets'])(timeline)}
+
+    def respond(self, method: str, target: str, body: bytes = b'') -> tuple[int, bytes, dict]:
+        """ (status, body, headers) for a request, latency is added by the caller """
+        with self.lock:
+            self.requests += 1
+            limited = self.rate_limit_every and self.requests % self.rate_limit_every == 0
+        reset = str(int(time.time()) + 1)
+        if limited:
+            return 429, b'{"errors":[{"code":88,"message":"Rate limit exceeded"}]}', {
+                'x-rate-limit-limit': '1000000', 'x-rate-limit-remaining': '0', 'x-rate-limit-reset': reset,
+            }
+        url = urlsplit(target)
+        name = url.path.rsplit('/', 1)[-1]
+        if method == 'POST':
+            variables = orjson.loads(body or b'{}').get('variables', {})
+        else:
+            variables = orjson.loads(parse_qs(url.query).get('variables', ['{}'])[0])
+        return 200, b'' if method == 'HEAD' else orjson.dumps(self.page(name, variables)), {
+            'x-rate-limit-limit': '1000000', 'x-rate-limit-remaining': '999999', 'x-rate-limit-reset': reset,
+        }
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                ...
+
+            def setup(self):
+                super().setup()
+                with mock.lock:
+                    mock.connections += 1
+
+            def do_GET(self):
+                body = self.rfile.read(int(self.headers.get('content-length', 0)))
+                if mock.latency:
+                    time.sleep(mock.latency)
+                self.send(*mock.respond(self.command, self.path, body))
+
+            do_POST = do_HEAD = do_GET
+
+            def send(self, status: int, body: bytes, headers: dict):
+                self.send_response(status)
+                self.send_header('content-type', 'application/json')
+                self.send_header('content-length', str(len(body)))
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+class H2Server:
+    """
+    Cleartext HTTP/2 (prior knowledge) front end for a `MockGraphQL`, for clients created with `http1=False`
+
+    Streams are served concurrently on an asyncio loop in a background thread.
+
+    @param mock: serves the pages and counts requests and connections
+    @param max_streams: SETTINGS_MAX_CONCURRENT_STREAMS advertised to clients
+    """
+
+    def __init__(self, mock: MockGraphQL, host: str = '127.0.0.1', port: int = 0, max_streams: int = 100):
+        self.mock = mock
+        self.host = host
+        self.port = port
+        self.max_streams = max_streams
+        self.loop = asyncio.new_event_loop()
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self.port}/i/api/graphql'
+
+    def start(self) -> 'H2Server':
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.handle, self.host, self.port))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        with self.mock.lock:
+            self.mock.connections += 1
+        conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False, header_encoding='utf-8'))
+        conn.initiate_connection()
+        conn.update_settings({h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS: self.max_streams})
+        writer.write(conn.data_to_send())
+        window = asyncio.Condition()
+        streams = {}
+        try:
+            while data := await reader.read(65536):
+                for e in conn.receive_data(data):
+                    if isinstance(e, h2.events.RequestReceived):
+                        streams[e.stream_id] = [dict(e.headers), b'']
+                    elif isinstance(e, h2.events.DataReceived):
+                        streams[e.stream_id][1] += e.data
+                        conn.acknowledge_received_data(e.flow_controlled_length, e.stream_id)
+                    elif isinstance(e, h2.events.StreamEnded):
+                        headers, body = streams.pop(e.stream_id)
+                        asyncio.create_task(self.respond(conn, writer, window, e.stream_id, headers, body))
+                    elif isinstance(e, h2.events.WindowUpdated):
+                        async with window:
+                            window.notify_all()
+                    elif isinstance(e, h2.events.ConnectionTerminated):
+                        return
+                writer.write(conn.data_to_send())
+        except (ConnectionError, h2.exceptions.ProtocolError):
+            ...
+        finally:
+            writer.close()
+
+    async def respond(self, conn, writer: asyncio.StreamWriter, window: asyncio.Condition,
+                      stream_id: int, headers: dict, body: bytes):
+        if self.mock.latency:
+            await asyncio.sleep(self.mock.latency)
+        status, body, extra = self.mock.respond(headers[':method'], headers[':path'], body)
+        try:
+            conn.send_headers(stream_id, [(':status', str(status)), ('content-type', 'application/json'),
+                                          ('content-length', str(len(body))), *extra.items()], end_stream=not body)
+            writer.write(conn.data_to_send())
+            while body:
+                while not (size := min(conn.local_flow_control_window(stream_id), conn.max_outbound_frame_size)):
+                    async with window:
+                        await window.wait()
+                conn.send_data(stream_id, body[:size], end_stream=size >= len(body))
+                body = body[size:]
+                writer.write(conn.data_to_send())
+        except (ConnectionError, h2.exceptions.ProtocolError):
+            ...
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', default='data/search_results')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--rate-limit-every', type=int, default=0)
+    args = parser.parse_args()
+    mock = MockGraphQL(args.dir, args.pages, args.latency, args.rate_limit_every, port=args.port)
+    print(f'Serving {len(mock.tweets)} tweets and {len(mock.users)} users on {mock.url}')
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == '__main__':
+    main()
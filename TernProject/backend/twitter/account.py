@@ -1,66 +1,76 @@
 import asyncio
 import hashlib
-import logging.config
+import logging
 import math
 import mimetypes
-import platform
 from copy import deepcopy
 from datetime import datetime
 from string import ascii_letters
 from uuid import uuid1, getnode
 
 from httpx import AsyncClient, Limits
-from tqdm import tqdm
-from tqdm.asyncio import tqdm_asyncio
 
 from .constants import *
 from .login import login
+from .ids import init_idset
+from .metrics import registry
+from .pool import init_pool
 from .util import *
 
-try:
-    if get_ipython().__class__.__name__ == 'ZMQInteractiveShell':
-        import nest_asyncio
-        nest_asyncio.apply()
-except:
-    ...
-
-if platform.system() != 'Windows':
-    try:
-        import uvloop
-        uvloop.install()
-    except ImportError as e:
-        ...
+tqdm = LazyImport('tqdm', 'tqdm')
+tqdm_asyncio = LazyImport('tqdm.asyncio', 'tqdm_asyncio')
 
 
 class Account:
 
     def __init__(self, email: str = None, username: str = None, password: str = None, session: Client = None, **kwargs):
+        init_event_loop()
         self.save = kwargs.get('save', True)
         self.debug = kwargs.get('debug', 0)
-        self.gql_api = 'https://twitter.com/i/api/graphql'
+        self.gql_api = kwargs.get('gql_api', 'https://twitter.com/i/api/graphql')
         self.v1_api = 'https://api.twitter.com/1.1'
         self.v2_api = 'https://twitter.com/i/api/2'
         self.logger = self._init_logger(**kwargs)
-        self.session = self._validate_session(email, username, password, session, **kwargs)
+        self.metrics = kwargs.get('metrics') or registry
+        self.pool = init_pool(self.logger, **kwargs)
+        self.session = self.pool.session if self.pool else self._validate_session(email, username, password, session, **kwargs)
         self.rate_limits = {}
+        self.features = kwargs.get('features')  # see `FEATURE_PROFILES`
+        self.id_set = init_idset(kwargs.get('id_set'))
 
-    def gql(self, method: str, operation: tuple, variables: dict, features: dict = Operation.default_features) -> dict:
+    def gql(self, method: str, operation: tuple, variables: dict, features: str | dict = None, pooled: bool = False) -> dict:
+        """
+        Send a GraphQL request.
+
+        @param method: HTTP method
+        @param operation: (queryId, operation name)
+        @param variables: GraphQL variables
+        @param features: feature profile name or features dict, see `get_features`. Defaults to the `features` keyword argument.
+        @param pooled: spread the request across `self.pool`. Only use for reads that do not depend on the account, writes and per-account timelines must come from the primary session.
+        @return: response as dict
+        """
         qid, op = operation
         params = {
             'queryId': qid,
-            'features': features,
+            'features': get_features(self.features if features is None else features, op),
             'variables': Operation.default_variables | variables
         }
         if method == 'POST':
             data = {'json': params}
         else:
             data = {'params': {k: orjson.dumps(v).decode() for k, v in params.items()}}
-        r = self.session.request(
-            method=method,
-            url=f'{self.gql_api}/{qid}/{op}',
-            headers=get_headers(self.session),
-            **data
-        )
+        if pooled and self.pool:
+            r = self.pool.send_sync(method, op, f'{self.gql_api}/{qid}/{op}', self.metrics, **data)
+        else:
+            start = time.perf_counter()
+            r = self.session.request(
+                method=method,
+                url=f'{self.gql_api}/{qid}/{op}',
+                headers=get_headers(self.session),
+                **data
+            )
+            self.metrics.observe(op, r, time.perf_counter() - start)
+        r = CachedResponse(r)
         self.rate_limits[op] = {k: int(v) for k, v in r.headers.items() if 'rate-limit' in k}
         if self.debug:
             log(self.logger, self.debug, r)
@@ -454,24 +464,26 @@ class Account:
     def bookmarks(self, limit=math.inf) -> list[dict]:
         return self._paginate('GET', Operation.Bookmarks, {}, limit)
 
-    def _paginate(self, method: str, operation: tuple, variables: dict, limit: int) -> list[dict]:
-        initial_data = self.gql(method, operation, variables)
+    def _paginate(self, method: str, operation: tuple, variables: dict, limit: int, features: str | dict = None) -> list[dict]:
+        initial_data = self.gql(method, operation, variables, features)
         res = [initial_data]
-        ids = set(find_key(initial_data, 'rest_id'))
+        found = find_keys(initial_data, 'rest_id', 'entries')
+        ids = self.id_set(int(x) for x in found['rest_id'] if x.isdigit())
         dups = 0
         DUP_LIMIT = 3
 
-        cursor = get_cursor(initial_data)
+        cursor = get_cursor(initial_data, found['entries'])
         while (dups < DUP_LIMIT) and cursor:
             prev_len = len(ids)
             if prev_len >= limit:
                 return res
 
             variables['cursor'] = cursor
-            data = self.gql(method, operation, variables)
+            data = self.gql(method, operation, variables, features)
 
-            cursor = get_cursor(data)
-            ids |= set(find_key(data, 'rest_id'))
+            found = find_keys(data, 'rest_id', 'entries')
+            cursor = get_cursor(data, found['entries'])
+            ids.update(int(x) for x in found['rest_id'] if x.isdigit())
 
             if self.debug:
                 self.logger.debug(f'cursor: {cursor}\tunique results: {len(ids)}')
@@ -601,6 +613,8 @@ class Account:
 
     def _init_logger(self, **kwargs) -> Logger:
         if kwargs.get('debug'):
+            import logging.config
+
             cfg = kwargs.get('log_config')
             logging.config.dictConfig(cfg or LOG_CONFIG)
 
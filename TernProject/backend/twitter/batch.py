@@ -0,0 +1,66 @@
+from collections import deque
+
+from .constants import MAX_GQL_CHAR_LIMIT
+
+# statuses returned when the request line or headers are too long
+TOO_LARGE = {413, 414, 431}
+
+
+class AdaptiveBatcher:
+    """
+    Packs ids into batches for the `*ByRestIds` operations, learning the largest batch the endpoint accepts.
+
+    The size of a batch is the number of id characters, like `util.batch_ids`. Starting from
+    `MAX_GQL_CHAR_LIMIT`, the budget is binary-searched between the largest batch that succeeded and the
+    smallest one rejected as too large. If the endpoint returns fewer results than ids were sent, the
+    returned count becomes a cap on ids per batch.
+
+    @param budget: initial character budget
+    @param ceiling: largest budget that will be tried
+    @param floor: smallest budget, reached only if the endpoint keeps rejecting batches
+    """
+
+    def __init__(self, budget: int = MAX_GQL_CHAR_LIMIT, ceiling: int = 3 * MAX_GQL_CHAR_LIMIT, floor: int = 100):
+        self.budget = budget
+        self.floor = floor
+        self.safe = 0  # largest batch that succeeded
+        self.unsafe = ceiling + 1  # smallest batch rejected as too large
+        self.max_count = None  # most results the endpoint returned for one batch
+
+    @staticmethod
+    def size(batch: list[str]) -> int:
+        return sum(map(len, batch))
+
+    def take(self, queue: deque) -> list[str]:
+        """ Pop the next batch from the front of `queue` """
+        batch, length = [], 0
+        while queue and (not batch or length + len(queue[0]) <= self.budget):
+            if self.max_count and len(batch) >= self.max_count:
+                break
+            x = queue.popleft()
+            batch.append(x)
+            length += len(x)
+        return batch
+
+    def success(self, batch: list[str], returned: int = None):
+        """
+        Record an accepted batch
+
+        @param batch: ids sent
+        @param returned: number of results in the response, if fewer than `len(batch)` the count is capped
+        """
+        size = self.size(batch)
+        self.safe = max(self.safe, size)
+        if returned is not None and 0 < returned < len(batch):
+            self.max_count = min(self.max_count or returned, returned)
+        # only a full batch says anything about the budget
+        if size >= self.budget * .9 and self.unsafe - self.safe > max(self.safe // 20, 1):
+            self.budget = (self.safe + self.unsafe) // 2
+
+    def too_large(self, batch: list[str]):
+        """ Record a batch rejected with 413/414/431 """
+        size = self.size(batch)
+        self.unsafe = min(self.unsafe, size)
+        if self.safe >= self.unsafe:  # the limit moved, e.g. longer headers
+            self.safe = 0
+        self.budget = max(self.floor, min(self.budget, (self.safe + self.unsafe) // 2 if self.safe else size // 2))
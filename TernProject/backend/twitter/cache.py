@@ -0,0 +1,135 @@
+import hashlib
+import time
+import zlib
+from pathlib import Path
+
+import orjson
+from httpx import Request, Response
+
+from .constants import CACHE_TTL
+from .util import CachedResponse, connect_db, init_store
+
+
+class ResponseCache:
+    """
+    Opt-in on-disk cache for idempotent GraphQL reads.
+
+    Responses are keyed by (queryId, variables, features). Each operation has its own TTL, operations
+    without a TTL are never cached. Once the cache grows past `max_size` bytes, the least recently used
+    responses are evicted.
+
+    @param path: sqlite database path
+    @param ttl: per-operation TTL overrides in seconds, e.g. {'UserTweets': 600}. Use 0 to disable an operation.
+    @param max_size: maximum size of the stored (compressed) bodies in bytes
+    """
+
+    def __init__(self, path: str | Path = 'data/cache.db', ttl: dict = None, max_size: int = 512 * 1024 ** 2):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = CACHE_TTL | (ttl or {})
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.db = connect_db(self.path)
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                operation TEXT NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+        ''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self.size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    @staticmethod
+    def key(qid: str, params: dict) -> str:
+        return hashlib.sha1(qid.encode() + orjson.dumps(params, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+    def get(self, name: str, url: str, qid: str, params: dict) -> CachedResponse | None:
+        """
+        Get a cached response
+
+        @param name: operation name
+        @param url: request url, used to rebuild the response
+        @param qid: query id
+        @param params: request params (variables, features)
+        @return: response, or None on a miss
+        """
+        if not (ttl := self.ttl.get(name)):
+            return
+        key = self.key(qid, params)
+        row = self.db.execute('SELECT body, size, created FROM responses WHERE key = ?', (key,)).fetchone()
+        now = time.time()
+        if not row or row[2] + ttl < now:
+            if row:
+                self.db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self.size -= row[1]
+            self.misses += 1
+            return
+        self.db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+        self.hits += 1
+        r = Response(
+            200,
+            headers={'content-type': 'application/json', 'x-cache': 'HIT'},
+            content=zlib.decompress(row[0]),
+            request=Request('GET', url, params=params),
+        )
+        return CachedResponse(r)
+
+    def set(self, name: str, qid: str, params: dict, r: CachedResponse):
+        """ Store a successful response, error responses are never cached """
+        if not self.ttl.get(name) or r.status_code != 200:
+            return
+        try:
+            if r.json().get('errors'):
+                return
+        except Exception:
+            return
+        body = zlib.compress(r.content, 1)
+        now = time.time()
+        key = self.key(qid, params)
+        if prev := self.db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone():
+            self.size -= prev[0]
+        self.db.execute(
+            'INSERT OR REPLACE INTO responses (key, operation, body, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)',
+            (key, name, body, len(body), now, now)
+        )
+        self.size += len(body)
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self, target: float = 0.9):
+        """ Drop least recently used responses until the cache is below `target` * `max_size` """
+        limit = self.max_size * target
+        rows = self.db.execute('SELECT key, size FROM responses ORDER BY accessed').fetchall()
+        stale = []
+        for key, size in rows:
+            if self.size <= limit:
+                break
+            stale.append((key,))
+            self.size -= size
+        self.db.executemany('DELETE FROM responses WHERE key = ?', stale)
+
+    def clear(self):
+        self.db.execute('DELETE FROM responses')
+        self.size = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0,
+            'entries': self.db.execute('SELECT COUNT(*) FROM responses').fetchone()[0],
+            'size': self.size,
+        }
+
+    def close(self):
+        self.db.close()
+
+
+def init_cache(cache: ResponseCache | str | Path | bool | None, default: str | Path) -> ResponseCache | None:
+    return init_store(ResponseCache, cache, default)
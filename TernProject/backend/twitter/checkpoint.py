@@ -0,0 +1,151 @@
+import time
+from pathlib import Path
+
+import orjson
+
+from .constants import CHECKPOINT_TTL
+from .util import connect_db, init_store
+
+
+class CheckpointStore:
+    """
+    Durable pagination checkpoints for resumable crawls.
+
+    One row per (operation, query variables) holding the last cursor and the number of unique
+    results seen so far. Rows are written after every page, so a crashed crawl resumes from
+    the last saved page, and queries that already finished are skipped for `ttl` seconds.
+    A query is only finished once its cursors run out, not when it stops at a `limit`.
+
+    @param path: sqlite database path
+    @param ttl: seconds a completed query is skipped for
+    """
+
+    def __init__(self, path: str | Path = 'data/checkpoints.db', ttl: float = CHECKPOINT_TTL):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = connect_db(self.path)
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                operation TEXT NOT NULL,
+                query TEXT NOT NULL,
+                cursor TEXT,
+                seen INTEGER NOT NULL DEFAULT 0,
+                pages INTEGER NOT NULL DEFAULT 0,
+                done INTEGER NOT NULL DEFAULT 0,
+                updated REAL NOT NULL,
+                PRIMARY KEY (operation, query)
+            )
+        ''')
+
+    @staticmethod
+    def key(query: dict) -> str:
+        return orjson.dumps(query, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS).decode()
+
+    def get(self, operation: str, query: dict) -> dict | None:
+        """
+        Get the checkpoint for a query
+
+        @param operation: operation name
+        @param query: query variables
+        @return: dict with `cursor`, `seen`, `pages` and `done`, or None if the query was never started
+        """
+        row = self.db.execute(
+            'SELECT cursor, seen, pages, done, updated FROM checkpoints WHERE operation = ? AND query = ?',
+            (operation, self.key(query))
+        ).fetchone()
+        if row:
+            cursor, seen, pages, done, updated = row
+            if done and updated + self.ttl < time.time():  # expired, crawl the query again from the start
+                self.db.execute('DELETE FROM checkpoints WHERE operation = ? AND query = ?', (operation, self.key(query)))
+                return
+            return {'cursor': cursor, 'seen': seen, 'pages': pages, 'done': bool(done)}
+
+    def save(self, operation: str, query: dict, cursor: str | None, seen: int, pages: int, done: bool = False):
+        self.db.execute('''
+            INSERT INTO checkpoints (operation, query, cursor, seen, pages, done, updated) VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (operation, query) DO UPDATE SET
+                cursor = excluded.cursor, seen = excluded.seen, pages = excluded.pages,
+                done = excluded.done, updated = excluded.updated
+        ''', (operation, self.key(query), cursor, seen, pages, int(done), time.time()))
+
+    def complete(self, operation: str, query: dict, seen: int, pages: int):
+        self.save(operation, query, None, seen, pages, done=True)
+
+    def clear(self, operation: str = None):
+        """ Remove checkpoints, for one operation or all of them """
+        if operation:
+            self.db.execute('DELETE FROM checkpoints WHERE operation = ?', (operation,))
+        else:
+            self.db.execute('DELETE FROM checkpoints')
+
+    def close(self):
+        self.db.close()
+
+
+class WatermarkStore:
+    """
+    Per-query high-water marks for "since last run" polling.
+
+    Stores the newest tweet id (and its timestamp) returned for each query, plus the number of
+    pages the first, full crawl of the query took, so later runs can report how many pages they saved.
+    """
+
+    def __init__(self, path: str | Path = 'data/watermarks.db'):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = connect_db(self.path)
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS watermarks (
+                operation TEXT NOT NULL,
+                query TEXT NOT NULL,
+                max_id INTEGER NOT NULL,
+                time REAL NOT NULL,
+                pages INTEGER NOT NULL DEFAULT 0,
+                updated REAL NOT NULL,
+                PRIMARY KEY (operation, query)
+            )
+        ''')
+
+    def get(self, operation: str, query: dict) -> dict | None:
+        """
+        Get the watermark for a query
+
+        @param operation: operation name
+        @param query: query variables
+        @return: dict with `max_id`, `time` (unix seconds of `max_id`) and `pages` (full crawl), or None
+        """
+        row = self.db.execute(
+            'SELECT max_id, time, pages FROM watermarks WHERE operation = ? AND query = ?',
+            (operation, CheckpointStore.key(query))
+        ).fetchone()
+        if row:
+            max_id, ts, pages = row
+            return {'max_id': max_id, 'time': ts, 'pages': pages}
+
+    def save(self, operation: str, query: dict, max_id: int, pages: int):
+        # tweet ids are snowflakes, the top bits are milliseconds since the twitter epoch
+        ts = ((max_id >> 22) + 1288834974657) / 1000
+        self.db.execute('''
+            INSERT INTO watermarks (operation, query, max_id, time, pages, updated) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (operation, query) DO UPDATE SET
+                max_id = MAX(max_id, excluded.max_id), time = MAX(time, excluded.time), updated = excluded.updated
+        ''', (operation, CheckpointStore.key(query), max_id, ts, pages, time.time()))
+
+    def clear(self, operation: str = None):
+        """ Remove watermarks, for one operation or all of them """
+        if operation:
+            self.db.execute('DELETE FROM watermarks WHERE operation = ?', (operation,))
+        else:
+            self.db.execute('DELETE FROM watermarks')
+
+    def close(self):
+        self.db.close()
+
+
+def init_checkpoints(checkpoint: CheckpointStore | str | Path | bool | None, default: str | Path) -> CheckpointStore | None:
+    return init_store(CheckpointStore, checkpoint, default)
+
+
+def init_watermarks(watermark: WatermarkStore | str | Path | bool | None, default: str | Path) -> WatermarkStore | None:
+    return init_store(WatermarkStore, watermark, default)
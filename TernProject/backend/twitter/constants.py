@@ -4,6 +4,27 @@ from dataclasses import dataclass
 MAX_GQL_CHAR_LIMIT = 4_200
 
 MAX_ENDPOINT_LIMIT = 500  # 500/15 mins
+RATE_LIMIT_WINDOW = 15 * 60  # seconds
+MAX_RATE_LIMIT_RETRIES = 3  # 429 responses to absorb per request before giving up
+
+# default response cache TTLs (seconds) for idempotent reads, operations not listed are never cached
+CACHE_TTL = {
+    'UserByScreenName': 24 * 60 * 60,
+    'UserByRestId': 24 * 60 * 60,
+    'UsersByRestIds': 24 * 60 * 60,
+    'TweetResultByRestId': 60 * 60,
+    'TweetResultsByRestIds': 60 * 60,
+    'SearchTimeline': 5 * 60,
+}
+
+# could not authenticate, suspended, invalid/expired token, bad authentication data, locked
+AUTH_ERROR_CODES = {32, 64, 89, 215, 326}
+
+# default lower bound for time-sliced searches without `since`
+SEARCH_SLICE_LOOKBACK = 7 * 24 * 60 * 60
+
+# completed checkpoints are skipped for this long, then the query is crawled again
+CHECKPOINT_TTL = 24 * 60 * 60
 
 MAX_IMAGE_SIZE = 5_242_880  # ~5 MB
 MAX_GIF_SIZE = 15_728_640  # ~15 MB
@@ -408,6 +429,46 @@ class Operation:
         'view_counts_everywhere_api_enabled': True
     }
 
+# Overrides of `Operation.default_features`, selected with the `features` keyword argument.
+# Every flag is still sent (requests missing a flag are rejected), disabled flags drop the
+# fields they gate from the response. Flags that change the shape of a tweet result, e.g.
+# `tweet_with_visibility_results_prefer_gql_limited_actions_policy_enabled`, are left alone.
+_LEAN_FEATURES = {
+    'blue_business_profile_image_shape_enabled': False,
+    'c9s_tweet_anatomy_moderator_badge_enabled': False,
+    'creator_subscriptions_tweet_preview_api_enabled': False,
+    'freedom_of_speech_not_reach_fetch_enabled': False,
+    'graphql_is_translatable_rweb_tweet_is_translatable_enabled': False,
+    'highlights_tweets_tab_ui_enabled': False,
+    'interactive_text_enabled': False,
+    'longform_notetweets_inline_media_enabled': False,
+    'longform_notetweets_rich_text_read_enabled': False,
+    'longform_notetweets_richtext_consumption_enabled': False,
+    'responsive_web_birdwatch_note_limit_enabled': False,
+    'responsive_web_twitter_article_data_v2_enabled': False,
+    'responsive_web_twitter_article_tweet_consumption_enabled': False,
+    'spaces_2022_h2_clipping': False,
+    'spaces_2022_h2_spaces_communities': False,
+    'standardized_nudges_misinfo': False,
+    'tweet_awards_web_tipping_enabled': False,
+    'vibe_api_enabled': False,
+}
+FEATURE_PROFILES = {
+    # everything the web client asks for
+    'full': {},
+    # text (including long tweets), ids, engagement and view counts, edit history
+    'analytics': _LEAN_FEATURES,
+    # text (including long tweets), ids and engagement counts
+    'minimal': _LEAN_FEATURES | {
+        'hidden_profile_likes_enabled': False,
+        'profile_foundations_tweet_stats_enabled': False,
+        'profile_foundations_tweet_stats_tweet_frequency': False,
+        'responsive_web_edit_tweet_api_enabled': False,
+        'subscriptions_verification_info_verified_since_enabled': False,
+        'view_counts_everywhere_api_enabled': False,
+    },
+}
+
 
 trending_params = {
     'include_profile_interstitial_type': '1',
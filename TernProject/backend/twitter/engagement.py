@@ -0,0 +1,297 @@
+import asyncio
+import math
+import time
+from array import array
+from pathlib import Path
+from typing import Generator
+
+from .constants import Operation
+from .retry import Failure
+from .util import connect_db, find_key
+
+# task states, as in the graph frontier
+QUEUED, RUNNING, DONE, FAILED = range(4)
+
+# values of the `kind` column
+FAVORITE, RETWEET = range(2)
+
+KINDS = {'favoriters': FAVORITE, 'retweeters': RETWEET}
+OPERATIONS = {FAVORITE: Operation.Favoriters, RETWEET: Operation.Retweeters}
+
+# column name -> array typecode
+COLUMNS = {'tweet_id': 'q', 'user_id': 'q', 'kind': 'B'}
+
+
+class EngagementStore:
+    """
+    Sharded columnar storage of (tweet_id, user_id, kind) rows.
+
+    Rows are sharded by `tweet_id % shards`, so joins and group-bys on tweet id stay within a shard.
+    Each shard is a directory `shard-NNN` holding one file per column, in native byte order:
+    `tweet_id.bin` (int64), `user_id.bin` (int64) and `kind.bin` (uint8, `FAVORITE` or `RETWEET`).
+    Row `i` of a shard is the `i`th value of every column, so a column can be loaded on its own,
+    e.g. `numpy.fromfile(path, 'int64')`.
+
+    Committed row counts are kept in `engagement.db`; columns are cut back to them on open, so rows
+    written by an interrupted run are dropped and refetched. The row span of every page is recorded too,
+    so the rows of one (tweet, kind) can be read without scanning its shard.
+
+    @param out: output directory
+    @param db: sqlite connection shared with the task queue
+    @param shards: number of shards, fixed once the store is created
+    """
+
+    def __init__(self, out: Path, db, shards: int = 16):
+        self.out = out
+        self.db = db
+        self.db.execute('CREATE TABLE IF NOT EXISTS shards (shard INTEGER PRIMARY KEY, rows INTEGER NOT NULL)')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS spans (
+                tweet_id INTEGER NOT NULL,
+                kind INTEGER NOT NULL,
+                start INTEGER NOT NULL,
+                rows INTEGER NOT NULL
+            )
+        ''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS spans_task ON spans (tweet_id, kind)')
+        existing = self.db.execute('SELECT COUNT(*) FROM shards').fetchone()[0]
+        if existing and existing != shards:
+            raise Exception(f'{out} has {existing} shards, got shards={shards}')
+        self.shards = shards
+        self.db.executemany('INSERT OR IGNORE INTO shards (shard, rows) VALUES (?, 0)', ((i,) for i in range(shards)))
+        self.fps = {}
+        for shard in range(shards):
+            path = self.out / f'shard-{shard:03d}'
+            path.mkdir(exist_ok=True)
+            for col in COLUMNS:
+                self.fps[shard, col] = open(path / f'{col}.bin', 'ab')
+        self.discard()
+
+    def discard(self):
+        """ Cut every column back to its committed rows, e.g. after a rolled back write """
+        for shard, rows in self.db.execute('SELECT shard, rows FROM shards').fetchall():
+            for col, typecode in COLUMNS.items():
+                self.fps[shard, col].truncate(rows * array(typecode).itemsize)
+
+    def write(self, tweet_id: int, kind: int, user_ids: array) -> int:
+        """
+        Append the rows of one page. The row count and span are updated in the caller's transaction.
+
+        @param tweet_id: tweet the users engaged with
+        @param kind: `FAVORITE` or `RETWEET`
+        @param user_ids: user ids
+        @return: shard the rows went to
+        """
+        shard = tweet_id % self.shards
+        start = self.db.execute('SELECT rows FROM shards WHERE shard = ?', (shard,)).fetchone()[0]
+        columns = {
+            'tweet_id': array('q', [tweet_id]) * len(user_ids),
+            'user_id': user_ids,
+            'kind': array('B', [kind]) * len(user_ids),
+        }
+        for col, values in columns.items():
+            fp = self.fps[shard, col]
+            values.tofile(fp)
+            fp.flush()
+        self.db.execute('UPDATE shards SET rows = rows + ? WHERE shard = ?', (len(user_ids), shard))
+        if user_ids:
+            self.db.execute('INSERT INTO spans (tweet_id, kind, start, rows) VALUES (?, ?, ?, ?)',
+                            (tweet_id, kind, start, len(user_ids)))
+        return shard
+
+    def read(self, shard: int, columns: tuple[str, ...] = tuple(COLUMNS)) -> dict[str, array]:
+        """ Committed rows of a shard, by column """
+        rows = self.db.execute('SELECT rows FROM shards WHERE shard = ?', (shard,)).fetchone()[0]
+        out = {}
+        for col in columns:
+            values = array(COLUMNS[col])
+            with open(self.out / f'shard-{shard:03d}' / f'{col}.bin', 'rb') as fp:
+                values.fromfile(fp, rows)
+            out[col] = values
+        return out
+
+    def users(self, tweet_id: int, kind: int) -> array:
+        """ Stored user ids of one tweet and kind, read from their spans only """
+        out = array(COLUMNS['user_id'])
+        spans = self.db.execute('SELECT start, rows FROM spans WHERE tweet_id = ? AND kind = ? ORDER BY start',
+                                (tweet_id, kind)).fetchall()
+        if spans:
+            with open(self.out / f'shard-{tweet_id % self.shards:03d}' / 'user_id.bin', 'rb') as fp:
+                for start, rows in spans:
+                    fp.seek(start * out.itemsize)
+                    out.fromfile(fp, rows)
+        return out
+
+    def rows(self) -> Generator[tuple[int, int, int], None, None]:
+        """ Yield (tweet_id, user_id, kind) for every stored row, shard by shard """
+        for shard in range(self.shards):
+            yield from zip(*self.read(shard).values())
+
+    def __len__(self):
+        return self.db.execute('SELECT COALESCE(SUM(rows), 0) FROM shards').fetchone()[0]
+
+    def close(self):
+        for fp in self.fps.values():
+            fp.close()
+        self.fps = {}
+
+
+class EngagementCrawler:
+    """
+    Bulk favoriters/retweeters crawl, built on `Scraper`.
+
+    Every (tweet, kind) pair is a task in `engagement.db` (sqlite) that records its last cursor, so
+    a crawl can be stopped and resumed mid-timeline and tweets can be streamed in while it runs.
+    Rows go to an `EngagementStore` as each page arrives. Users repeated within a task are dropped, also
+    across a resume.
+
+    Both operations share one pacing loop: a worker takes the next task whose operation still has
+    budget in the current rate-limit window, so one operation keeps running while the other waits
+    for its window to reset. Tasks whose requests fail are marked failed and retried on the next run.
+    The scraper's `save` is turned off, the store replaces the per-query JSON files.
+
+    e.g.
+        crawler = EngagementCrawler(scraper, 'data/engagement')
+        crawler.run(tweet_ids)
+        for shard in range(crawler.store.shards):
+            columns = crawler.store.read(shard)
+
+    @param scraper: `Scraper` used for the requests
+    @param out: output directory for `engagement.db` and the shards
+    @param kinds: `favoriters`, `retweeters` or both
+    @param shards: number of shards
+    @param limit: maximum number of users fetched per tweet and kind
+    @param concurrency: tasks run concurrently
+    """
+
+    def __init__(self, scraper, out: str | Path = 'data/engagement', kinds: tuple[str, ...] = ('favoriters', 'retweeters'),
+                 shards: int = 16, limit: int | float = math.inf, concurrency: int = 8):
+        if not set(kinds) <= KINDS.keys():
+            raise Exception(f'Unknown kind in {kinds}, expected {list(KINDS)}')
+        self.scraper = scraper
+        self.scraper.save = False
+        self.out = Path(out)
+        self.out.mkdir(parents=True, exist_ok=True)
+        self.kinds = tuple(KINDS[k] for k in kinds)
+        self.limit = limit
+        self.concurrency = concurrency
+        self.stats = {'done': 0, 'failed': 0, 'pages': 0, 'rows': 0}
+        self.db = connect_db(self.out / 'engagement.db')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS tasks (
+                tweet_id INTEGER NOT NULL,
+                kind INTEGER NOT NULL,
+                cursor TEXT,
+                state INTEGER NOT NULL DEFAULT 0,
+                rows INTEGER NOT NULL DEFAULT 0,
+                updated REAL NOT NULL,
+                PRIMARY KEY (tweet_id, kind)
+            )
+        ''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS queue ON tasks (state, kind)')
+        # a previous run stopped mid-task, pick those up again from their last cursor. A task that
+        # committed its last page (no cursor left) but was not marked done yet is complete.
+        self.db.execute('UPDATE tasks SET state = ? WHERE state = ? AND cursor IS NULL AND rows > 0', (DONE, RUNNING))
+        self.db.execute('UPDATE tasks SET state = ? WHERE state IN (?, ?)', (QUEUED, RUNNING, FAILED))
+        self.store = EngagementStore(self.out, self.db, shards)
+
+    def run(self, tweet_ids: list[int] = ()) -> dict:
+        return self.scraper._sync(self.arun(tweet_ids))
+
+    async def arun(self, tweet_ids: list[int] = ()) -> dict:
+        """
+        Crawl `tweet_ids` and any tasks left by a previous run
+
+        @param tweet_ids: tweet ids to add
+        @return: crawl stats
+        """
+        self.add(tweet_ids)
+        client = await self.scraper._get_client()
+        lock = asyncio.Lock()
+
+        async def worker():
+            while True:
+                async with lock:
+                    task = await self._next()
+                if task is None:
+                    return
+                await self._crawl(client, *task)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        return self.stats
+
+    def add(self, tweet_ids: list[int]):
+        """ Queue tweets for every kind, tweets already known keep their state """
+        now = time.time()
+        self.db.executemany('INSERT OR IGNORE INTO tasks (tweet_id, kind, updated) VALUES (?, ?, ?)',
+                            ((int(x), kind, now) for x in tweet_ids for kind in self.kinds))
+
+    async def _next(self) -> tuple[int, int, str | None] | None:
+        """ Next task of an operation with budget left, waiting for a window to reset if there is none """
+        while True:
+            queued = [k for (k,) in self.db.execute(
+                f'SELECT DISTINCT kind FROM tasks WHERE state = ? AND kind IN ({",".join("?" * len(self.kinds))})',
+                (QUEUED, *self.kinds)).fetchall()]
+            if not queued:
+                return None
+            # each account in the pool is paced separately
+            delays = {k: 0 if self.scraper.pool else self.scraper.rate_limiter.delay(OPERATIONS[k][-1]) for k in queued}
+            ready = [k for k, d in delays.items() if d <= 0]
+            if ready:
+                row = self.db.execute(
+                    f'SELECT tweet_id, kind, cursor FROM tasks WHERE state = ? AND kind IN ({",".join("?" * len(ready))}) ORDER BY rowid LIMIT 1',
+                    (QUEUED, *ready)).fetchone()
+                self.db.execute('UPDATE tasks SET state = ?, updated = ? WHERE tweet_id = ? AND kind = ?',
+                                (RUNNING, time.time(), row[0], row[1]))
+                return row
+            wait = min(delays.values())
+            if self.scraper.debug:
+                self.scraper.logger.debug(f'Engagement crawl waiting {wait:.0f}s for the rate limit')
+            await asyncio.sleep(wait)
+
+    async def _crawl(self, client, tweet_id: int, kind: int, cursor: str | None):
+        failures = len(self.scraper.failures)
+        seen = self.scraper.id_set()
+        if cursor:  # resumed, users re-served across the page boundary are already stored
+            seen.update(self.store.users(tweet_id, kind))
+        ok = True
+        try:
+            async for _, data, next_cursor in self.scraper._pages(client, OPERATIONS[kind], tweetId=tweet_id, limit=self.limit,
+                                                                  **({'cursor': cursor} if cursor else {})):
+                ids = array('q')
+                for x in find_key(data, 'user_results'):
+                    if (u := x.get('result')) and u.get('rest_id') and (user_id := int(u['rest_id'])) not in seen:
+                        seen.add(user_id)
+                        ids.append(user_id)
+                # rows and cursor are committed together, so a resumed task neither skips nor repeats a page
+                self.db.execute('BEGIN')
+                self.store.write(tweet_id, kind, ids)
+                self.db.execute('UPDATE tasks SET cursor = ?, rows = rows + ?, updated = ? WHERE tweet_id = ? AND kind = ?',
+                                (next_cursor, len(ids), time.time(), tweet_id, kind))
+                self.db.execute('COMMIT')
+                self.stats['pages'] += 1
+                self.stats['rows'] += len(ids)
+        except Exception as e:
+            ok = False
+            if self.db.in_transaction:
+                self.db.execute('ROLLBACK')
+                self.store.discard()
+            if self.scraper.debug:
+                self.scraper.logger.error(f'Failed to crawl {tweet_id} ({OPERATIONS[kind][-1]})\n{e}')
+        # `_pages` records a failure whenever pagination is cut off, so a task without one reached its last page
+        ok = ok and not any(isinstance(f, Failure) and f.operation == OPERATIONS[kind][-1] and (f.query or {}).get('tweetId') == tweet_id
+                            for f in self.scraper.failures[failures:])
+        self.stats['done' if ok else 'failed'] += 1
+        self.db.execute('UPDATE tasks SET state = ?, updated = ? WHERE tweet_id = ? AND kind = ?',
+                        (DONE if ok else FAILED, time.time(), tweet_id, kind))
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+
+    def pending(self) -> int:
+        """ Number of tasks left to run """
+        return self.db.execute('SELECT COUNT(*) FROM tasks WHERE state = ?', (QUEUED,)).fetchone()[0]
+
+    def close(self):
+        self.store.close()
+        self.db.close()
@@ -0,0 +1,72 @@
+import asyncio
+from typing import Awaitable, Callable
+
+import orjson
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight requests.
+
+    The first caller for a key starts the request, callers arriving while it is in flight await the same
+    task and receive the same result (or exception). Nothing is kept once the request completes, repeated
+    requests over time are the response cache's job.
+
+    The result is shared, not copied, callers must not mutate the parsed data.
+
+    @param metrics: `Metrics` to record coalesced calls in
+    """
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self.calls = {}
+        self.stats = {'started': 0, 'coalesced': 0}
+
+    def __len__(self):
+        return len(self.calls)
+
+    @staticmethod
+    def key(name: str, query: dict) -> tuple:
+        return name, orjson.dumps(query, option=orjson.OPT_SORT_KEYS)
+
+    async def do(self, name: str, query: dict, fn: Callable[[], Awaitable]) -> any:
+        """
+        Await `fn()`, or the identical request already in flight
+
+        @param name: operation name
+        @param query: GraphQL variables and features, with `name` the identity of the request
+        @param fn: starts the request
+        @return: result of `fn()`
+        """
+        loop = asyncio.get_running_loop()
+        key = self.key(name, query)
+        task = self.calls.get(key)
+        if task is not None and task.get_loop() is loop:
+            self.stats['coalesced'] += 1
+            if self.metrics is not None:
+                self.metrics.coalesced(name)
+            # a cancelled caller must not cancel the request for the others
+            return await asyncio.shield(task)
+        task = loop.create_task(fn())
+        self.calls[key] = task
+        self.stats['started'] += 1
+        task.add_done_callback(_forget(self.calls, key))
+        return await asyncio.shield(task)
+
+
+def _forget(calls: dict, key: tuple) -> Callable[[asyncio.Task], None]:
+    def done(task: asyncio.Task):
+        if calls.get(key) is task:
+            del calls[key]
+        # every caller may have been cancelled, don't warn about an exception nobody awaited
+        if not task.cancelled():
+            task.exception()
+
+    return done
+
+
+def init_flight(coalesce: SingleFlight | bool | None, metrics=None) -> SingleFlight | None:
+    """ Build the request coalescer from the `coalesce` keyword argument, enabled by default """
+    if isinstance(coalesce, SingleFlight):
+        return coalesce
+    return SingleFlight(metrics) if coalesce is None or coalesce else None
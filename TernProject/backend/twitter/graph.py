@@ -0,0 +1,290 @@
+import asyncio
+import math
+import re
+import time
+from array import array
+from pathlib import Path
+from typing import Callable, Generator
+
+from .constants import Operation
+from .retry import Failure
+from .util import connect_db, find_key
+
+# node states in the frontier
+QUEUED, RUNNING, DONE, FAILED = range(4)
+
+DIRECTIONS = {'followers': Operation.Followers, 'following': Operation.Following}
+
+
+class EdgeStore:
+    """
+    Append-only adjacency storage for a follower graph.
+
+    Every page of followers/following is stored as one block of int64 user ids in rotating
+    `edges-NNNNNN.bin` segments (native byte order), indexed by (user, direction, page cursor) in
+    `graph.db`. A multi-million-edge graph costs 8 bytes per edge on disk and nothing in memory.
+
+    @param out: output directory
+    @param db: sqlite connection shared with the frontier
+    @param segment_size: rotate to a new segment once the current one reaches this many bytes
+    """
+
+    def __init__(self, out: Path, db, segment_size: int = 256 * 1024 ** 2):
+        self.out = out
+        self.db = db
+        self.segment_size = segment_size
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS adjacency (
+                id INTEGER NOT NULL,
+                direction TEXT NOT NULL,
+                cursor TEXT NOT NULL,
+                segment INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (id, direction, cursor)
+            )
+        ''')
+        existing = [int(m.group(1)) for p in self.out.glob('edges-*.bin') if (m := re.search(r'(\d+)', p.name))]
+        self.index = max(existing, default=0)
+        self.fp = None
+
+    def _segment(self):
+        if self.fp is None or self.fp.tell() >= self.segment_size:
+            if self.fp:
+                self.fp.close()
+            self.index += 1
+            self.fp = open(self.out / f'edges-{self.index:06d}.bin', 'ab')
+        return self.fp
+
+    def write(self, user_id: int, direction: str, cursor: str | None, ids: array) -> bool:
+        """
+        Append one page of neighbours
+
+        @param user_id: user whose followers/following these are
+        @param direction: `followers` or `following`
+        @param cursor: cursor the page was fetched with, a page that was already stored is skipped
+        @param ids: neighbour ids
+        @return: False if the page was already stored
+        """
+        if self.db.execute('SELECT 1 FROM adjacency WHERE id = ? AND direction = ? AND cursor = ?',
+                           (user_id, direction, cursor or '')).fetchone():
+            return False
+        fp = self._segment()
+        offset = fp.tell()
+        ids.tofile(fp)
+        fp.flush()
+        self.db.execute('INSERT INTO adjacency (id, direction, cursor, segment, offset, count) VALUES (?, ?, ?, ?, ?, ?)',
+                        (user_id, direction, cursor or '', self.index, offset, len(ids)))
+        return True
+
+    def _read(self, segment: int, offset: int, count: int) -> array:
+        ids = array('q')
+        with open(self.out / f'edges-{segment:06d}.bin', 'rb') as fp:
+            fp.seek(offset)
+            ids.fromfile(fp, count)
+        return ids
+
+    def neighbors(self, user_id: int, direction: str = 'followers') -> array:
+        """ Sorted unique ids of a user's followers or following """
+        rows = self.db.execute('SELECT segment, offset, count FROM adjacency WHERE id = ? AND direction = ?',
+                               (user_id, direction)).fetchall()
+        ids = set()
+        for row in rows:
+            ids.update(self._read(*row))
+        return array('q', sorted(ids))
+
+    def edges(self) -> Generator[tuple[int, int], None, None]:
+        """ Yield (follower, followed) for every stored edge, in storage order """
+        rows = self.db.execute('SELECT id, direction, segment, offset, count FROM adjacency ORDER BY segment, offset')
+        for user_id, direction, *block in rows.fetchall():
+            for x in self._read(*block):
+                yield (x, user_id) if direction == 'followers' else (user_id, x)
+
+    def __len__(self):
+        return self.db.execute('SELECT COALESCE(SUM(count), 0) FROM adjacency').fetchone()[0]
+
+    def close(self):
+        if self.fp:
+            self.fp.close()
+            self.fp = None
+
+
+class GraphCrawler:
+    """
+    Breadth-first (or priority-ordered) crawl of the follower graph, built on `Scraper`.
+
+    The frontier lives in `graph.db` (sqlite), so a crawl can be stopped and resumed and every user is
+    expanded at most once. Nodes are expanded in order of depth, then priority, or of priority alone
+    with `order='priority'`. Edges go to an `EdgeStore` as each page arrives.
+
+    Requests are paced by the scraper's rate limiter: when an operation's budget for the current window
+    is used up, workers wait for the next window instead of reserving tokens far ahead. Users whose
+    requests fail are marked failed and retried on the next run. The scraper's `save` is turned off,
+    the edge store replaces the per-query JSON files.
+
+    e.g.
+        crawler = GraphCrawler(scraper, 'data/graph', depth=2, budget=10_000,
+                               priority=lambda user: user['legacy']['followers_count'])
+        crawler.run([44196397])
+        for follower, followed in crawler.edges.edges():
+            ...
+
+    @param scraper: `Scraper` used for the requests
+    @param out: output directory for `graph.db` and the edge segments
+    @param directions: `followers`, `following` or both
+    @param depth: maximum number of hops from the seeds. Users closer than `depth` are expanded, users at
+        `depth` are only recorded, so `depth=1` fetches the seeds' followers/following.
+    @param budget: maximum number of users to expand per run
+    @param limit: maximum number of followers/following fetched per user and direction
+    @param priority: score of a discovered user from its user result, higher is expanded first
+    @param order: `bfs` (depth, then priority) or `priority`
+    @param concurrency: users expanded concurrently
+    """
+
+    def __init__(self, scraper, out: str | Path = 'data/graph', directions: tuple[str, ...] = ('followers', 'following'),
+                 depth: int = 1, budget: int | float = math.inf, limit: int | float = math.inf,
+                 priority: Callable[[dict], float] = None, order: str = 'bfs', concurrency: int = 8):
+        if order not in {'bfs', 'priority'}:
+            raise Exception(f'Unknown order {order!r}, expected `bfs` or `priority`')
+        if not set(directions) <= DIRECTIONS.keys():
+            raise Exception(f'Unknown direction in {directions}, expected {list(DIRECTIONS)}')
+        self.scraper = scraper
+        self.scraper.save = False
+        self.out = Path(out)
+        self.out.mkdir(parents=True, exist_ok=True)
+        self.directions = tuple(directions)
+        self.depth = depth
+        self.budget = budget
+        self.limit = limit
+        self.priority = priority
+        self.order = order
+        self.concurrency = concurrency
+        self.stats = {'expanded': 0, 'failed': 0, 'discovered': 0, 'pages': 0, 'edges': 0}
+        self.db = connect_db(self.out / 'graph.db')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS nodes (
+                id INTEGER PRIMARY KEY,
+                screen_name TEXT,
+                depth INTEGER NOT NULL,
+                priority REAL NOT NULL DEFAULT 0,
+                state INTEGER NOT NULL DEFAULT 0,
+                updated REAL NOT NULL
+            )
+        ''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS frontier ON nodes (state, depth, priority)')
+        # a previous run stopped mid-expansion, pick those users up again
+        self.db.execute('UPDATE nodes SET state = ? WHERE state IN (?, ?)', (QUEUED, RUNNING, FAILED))
+        self.edges = EdgeStore(self.out, self.db)
+
+    def run(self, seeds: list[int] = ()) -> dict:
+        return self.scraper._sync(self.arun(seeds))
+
+    async def arun(self, seeds: list[int] = ()) -> dict:
+        """
+        Crawl from `seeds` and from any users left in the frontier by a previous run
+
+        @param seeds: user ids to start from
+        @return: crawl stats
+        """
+        self.add(seeds, 0)
+        expanded = inflight = 0
+        client = await self.scraper._get_client()
+        cond = asyncio.Condition()
+
+        async def worker():
+            nonlocal expanded, inflight
+            while True:
+                async with cond:
+                    while True:
+                        if expanded >= self.budget:
+                            return
+                        node = self._next()
+                        if node is not None:
+                            break
+                        # the frontier is empty, but expansions in flight may still add to it
+                        if not inflight:
+                            return
+                        await cond.wait()
+                    expanded += 1
+                    inflight += 1
+                try:
+                    await self._pace()  # outside the lock, finished workers must still be able to report back
+                    await self._expand(client, *node)
+                finally:
+                    async with cond:
+                        inflight -= 1
+                        cond.notify_all()
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        return self.stats
+
+    def add(self, user_ids: list[int], depth: int, users: list[dict] = None):
+        """ Add users to the frontier, users already known keep their depth and state """
+        now = time.time()
+        rows = []
+        for i, user_id in enumerate(user_ids):
+            user = users[i] if users else None
+            name = user.get('legacy', {}).get('screen_name') if user else None
+            score = self.priority(user) if self.priority and user else 0
+            rows.append((int(user_id), name, depth, score, now))
+        before = self.db.total_changes
+        self.db.executemany('INSERT OR IGNORE INTO nodes (id, screen_name, depth, priority, updated) VALUES (?, ?, ?, ?, ?)', rows)
+        self.stats['discovered'] += self.db.total_changes - before
+
+    def _next(self) -> tuple[int, int] | None:
+        order = 'depth, priority DESC, rowid' if self.order == 'bfs' else 'priority DESC, depth, rowid'
+        row = self.db.execute(f'SELECT id, depth FROM nodes WHERE state = ? AND depth < ? ORDER BY {order} LIMIT 1',
+                              (QUEUED, self.depth)).fetchone()
+        if row:
+            self.db.execute('UPDATE nodes SET state = ?, updated = ? WHERE id = ?', (RUNNING, time.time(), row[0]))
+        return row
+
+    async def _pace(self):
+        """ Wait out an exhausted rate-limit window rather than queue requests into later ones """
+        if self.scraper.pool:
+            return  # each account in the pool is paced separately
+        limiter = self.scraper.rate_limiter
+        wait = max(limiter.delay(DIRECTIONS[d][-1]) for d in self.directions)
+        if wait > 0:
+            if self.scraper.debug:
+                self.scraper.logger.debug(f'Graph crawl waiting {wait:.0f}s for the rate limit')
+            await asyncio.sleep(wait)
+
+    async def _expand(self, client, user_id: int, depth: int):
+        failures = len(self.scraper.failures)
+        ok = True
+        for direction in self.directions:
+            operation = DIRECTIONS[direction]
+            # `_pages` resumes from the checkpoint, pages are keyed by the cursor they were fetched with
+            cp = self.scraper.checkpoints.get(operation[-1], {'userId': user_id}) if self.scraper.checkpoints else None
+            cursor = cp['cursor'] if cp and not cp['done'] else None
+            try:
+                async for _, data, next_cursor in self.scraper._pages(client, operation, userId=user_id, limit=self.limit):
+                    users = [u for x in find_key(data, 'user_results') if (u := x.get('result')) and u.get('rest_id')]
+                    # the first entry can be the user being expanded, e.g. on protected accounts
+                    users = [u for u in users if int(u['rest_id']) != user_id]
+                    ids = array('q', (int(u['rest_id']) for u in users))
+                    if self.edges.write(user_id, direction, cursor, ids):
+                        self.stats['edges'] += len(ids)
+                    self.stats['pages'] += 1
+                    self.add(ids, depth + 1, users)
+                    cursor = next_cursor
+            except Exception as e:
+                ok = False
+                if self.scraper.debug:
+                    self.scraper.logger.error(f'Failed to expand {user_id} ({direction})\n{e}')
+        ok = ok and not any(isinstance(f, Failure) and f.query.get('userId') == user_id
+                            for f in self.scraper.failures[failures:])
+        self.stats['expanded' if ok else 'failed'] += 1
+        self.db.execute('UPDATE nodes SET state = ?, updated = ? WHERE id = ?', (DONE if ok else FAILED, time.time(), user_id))
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM nodes').fetchone()[0]
+
+    def frontier(self) -> int:
+        """ Number of users left to expand within the depth limit """
+        return self.db.execute('SELECT COUNT(*) FROM nodes WHERE state = ? AND depth < ?', (QUEUED, self.depth)).fetchone()[0]
+
+    def close(self):
+        self.edges.close()
+        self.db.close()
@@ -0,0 +1,193 @@
+import atexit
+import hashlib
+import heapq
+import os
+import re
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+
+import orjson
+
+from .util import init_store
+
+ENTRY_ID = re.compile(r'^tweet-(\d+)$')
+USER_ENTRY_ID = re.compile(r'^user-(\d+)$')
+
+
+class IdIndex:
+    """
+    Persistent index of tweet ids seen in earlier runs.
+
+    Ids are kept on disk as a sorted array of int64 (8 bytes per id), lookups are a binary search.
+    New ids go into a small in-memory set and are merged into the array on `save`, which also
+    merges ids written to the same file by other runs in the meantime.
+
+    Ids can be recorded under a scope (see `index_scope`), so that a tweet seen by one query doesn't make
+    another query look already crawled. A scoped id is stored xor-ed with a 64-bit hash of its scope.
+
+    @param path: index file path
+    """
+
+    def __init__(self, path: str | Path = 'data/ids.bin'):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ids = self._read()
+        self.pending = set()
+        atexit.register(self.save)
+
+    def __len__(self) -> int:
+        return len(self.ids) + len(self.pending)
+
+    def __contains__(self, x: int | str) -> bool:
+        x = int(x)
+        if x in self.pending:
+            return True
+        i = bisect_left(self.ids, x)
+        return i < len(self.ids) and self.ids[i] == x
+
+    def add(self, x: int | str) -> bool:
+        """ Add an id, returning True if it was not seen before """
+        if x in self:
+            return False
+        self.pending.add(int(x))
+        return True
+
+    def update(self, ids, scope: str = None) -> int:
+        """ Add ids, returning the number of new ones """
+        key = self.key(scope)
+        return sum(self.add(int(x) ^ key) for x in ids)
+
+    def known(self, ids, scope: str = None) -> bool:
+        """ True if every id was seen before, within `scope` if given """
+        key = self.key(scope)
+        return all((int(x) ^ key) in self for x in ids)
+
+    @staticmethod
+    def key(scope: str | None) -> int:
+        if not scope:
+            return 0
+        return int.from_bytes(hashlib.blake2b(scope.encode(), digest_size=8).digest(), 'big', signed=True)
+
+    def save(self):
+        if not self.pending:
+            return
+        merged = array('q')
+        last = None
+        for x in heapq.merge(self._read(), self.ids, sorted(self.pending)):
+            if x != last:
+                merged.append(x)
+                last = x
+        tmp = self.path.with_suffix('.tmp')
+        with open(tmp, 'wb') as fp:
+            merged.tofile(fp)
+        os.replace(tmp, self.path)
+        self.ids = merged
+        self.pending = set()
+
+    def _read(self) -> array:
+        ids = array('q')
+        if self.path.exists():
+            with open(self.path, 'rb') as fp:
+                ids.frombytes(fp.read())
+        return ids
+
+
+def index_scope(operation: str, query: dict) -> str:
+    """ Scope of a query in an `IdIndex`, one per (operation, query variables) """
+    return operation + orjson.dumps(query, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS).decode()
+
+
+class IdSet:
+    """
+    Compact in-memory set of int64 ids, used to count unique results while paginating.
+
+    Ids are kept sorted in blocks of `array('q')` (8 bytes per id) of at most `2 * load` ids, with the
+    last id of each block in a plain list to find the block. Lookups are two binary searches, inserts
+    shift at most one block. A `set` of `rest_id` strings costs roughly 70-100 bytes per id.
+
+    Supports the `set` operations used for dedupe: `add`, `update`, `|=`, `in`, `len` and iteration
+    (in ascending order).
+
+    @param ids: initial ids
+    @param load: block size, blocks are split in two once they reach twice this size
+    """
+    __slots__ = ('blocks', 'maxes', 'size', 'load')
+
+    def __init__(self, ids=(), load: int = 1024):
+        self.blocks = []
+        self.maxes = []
+        self.size = 0
+        self.load = load
+        self.update(ids)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, x: int | str) -> bool:
+        x = int(x)
+        i = bisect_left(self.maxes, x)
+        if i == len(self.maxes):
+            return False
+        block = self.blocks[i]
+        return block[bisect_left(block, x)] == x
+
+    def __iter__(self):
+        for block in self.blocks:
+            yield from block
+
+    def __ior__(self, ids) -> 'IdSet':
+        self.update(ids)
+        return self
+
+    def add(self, x: int | str) -> bool:
+        """ Add an id, returning True if it is new """
+        return self.update((x,)) == 1
+
+    def update(self, ids) -> int:
+        """ Add ids, returning the number of new ones """
+        blocks, maxes, new = self.blocks, self.maxes, 0
+        for x in ids:
+            x = int(x)
+            i = bisect_left(maxes, x)
+            if i == len(maxes):
+                if not maxes:
+                    blocks.append(array('q', (x,)))
+                    maxes.append(x)
+                    new += 1
+                    continue
+                i -= 1
+                block = blocks[i]
+                block.append(x)
+                maxes[i] = x
+            else:
+                block = blocks[i]
+                j = bisect_left(block, x)
+                if block[j] == x:
+                    continue
+                block.insert(j, x)
+            new += 1
+            if len(block) >= 2 * self.load:
+                blocks[i:i + 1] = block[:self.load], block[self.load:]
+                maxes[i:i + 1] = block[self.load - 1], block[-1]
+        self.size += new
+        return new
+
+
+def tweet_ids(entries: list[dict]) -> list[int]:
+    """ Tweet ids of timeline entries, cursors and modules are skipped """
+    return [int(m.group(1)) for e in entries if (m := ENTRY_ID.match(e.get('entryId', '')))]
+
+
+def user_ids(entries: list[dict]) -> list[int]:
+    """ User ids of timeline entries, e.g. `People` search results """
+    return [int(m.group(1)) for e in entries if (m := USER_ENTRY_ID.match(e.get('entryId', '')))]
+
+
+def init_index(index: IdIndex | str | Path | bool | None, default: str | Path) -> IdIndex | None:
+    return init_store(IdIndex, index, default)
+
+
+def init_idset(id_set: type | None):
+    """ Factory for the id sets used to dedupe pages, from the `id_set` keyword argument, e.g. `set` or `IdSet` """
+    return id_set or IdSet
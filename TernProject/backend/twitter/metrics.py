@@ -0,0 +1,176 @@
+import threading
+import time
+from bisect import bisect_left
+
+from httpx import Response
+
+# seconds
+LATENCY_BUCKETS = (.05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: tuple = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last bucket is +Inf
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, v: float):
+        self.counts[bisect_left(self.bounds, v)] += 1
+        self.sum += v
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """ Upper bound of the bucket holding quantile `q` """
+        target = q * self.count
+        n = 0
+        for bound, c in zip(self.bounds + (float('inf'),), self.counts):
+            n += c
+            if n >= target and n:
+                return bound
+        return 0.
+
+
+class OperationMetrics:
+    __slots__ = ('latency', 'requests', 'bytes_in', 'pages', 'retries', 'cache_hits', 'coalesced', 'status', 'rate_limit')
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.requests = 0
+        self.bytes_in = 0
+        self.pages = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.coalesced = 0  # requests saved by joining an identical in-flight request
+        self.status = {'2xx': 0, '3xx': 0, '4xx': 0, '5xx': 0}
+        self.rate_limit = {}  # last seen x-rate-limit-{limit,remaining,reset}
+
+
+class Metrics:
+    """
+    In-process metrics for GraphQL operations.
+
+    Updated from response headers and sizes only, bodies are never parsed. Export with `prometheus()`
+    (text exposition format) or `snapshot()` (plain dict, e.g. for `orjson.dumps`).
+
+    e.g.
+        from twitter.metrics import registry
+        print(registry.prometheus())
+    """
+
+    def __init__(self, prefix: str = 'twitter_graphql'):
+        self.prefix = prefix
+        self.operations = {}
+        self.lock = threading.Lock()  # `Account` is sync and may be used from threads
+        self.started = time.time()
+
+    def __getitem__(self, name: str) -> OperationMetrics:
+        if name not in self.operations:
+            self.operations[name] = OperationMetrics()
+        return self.operations[name]
+
+    def observe(self, name: str, r: Response, elapsed: float):
+        """
+        Record a response received from the network
+
+        @param name: operation name
+        @param r: response
+        @param elapsed: request latency in seconds
+        """
+        with self.lock:
+            m = self[name]
+            m.requests += 1
+            m.latency.observe(elapsed)
+            m.bytes_in += len(r.content)
+            m.status[f'{r.status_code // 100}xx'] = m.status.get(f'{r.status_code // 100}xx', 0) + 1
+            if r.status_code == 200:
+                m.pages += 1
+            for k in ('limit', 'remaining', 'reset'):
+                if (v := r.headers.get(f'x-rate-limit-{k}')) is not None and v.isdigit():
+                    m.rate_limit[k] = int(v)
+
+    def cached(self, name: str):
+        """ Record a page served from the response cache """
+        with self.lock:
+            m = self[name]
+            m.cache_hits += 1
+            m.pages += 1
+
+    def coalesced(self, name: str):
+        """ Record a request answered by an identical request already in flight """
+        with self.lock:
+            self[name].coalesced += 1
+
+    def retry(self, name: str):
+        with self.lock:
+            self[name].retries += 1
+
+    def reset(self):
+        with self.lock:
+            self.operations = {}
+            self.started = time.time()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'started': self.started,
+                'time': time.time(),
+                'operations': {
+                    name: {
+                        'requests': m.requests,
+                        'pages': m.pages,
+                        'retries': m.retries,
+                        'cache_hits': m.cache_hits,
+                        'coalesced': m.coalesced,
+                        'bytes_in': m.bytes_in,
+                        'status': dict(m.status),
+                        'rate_limit': dict(m.rate_limit),
+                        'latency': {
+                            'count': m.latency.count,
+                            'sum': m.latency.sum,
+                            'p50': m.latency.quantile(.5),
+                            'p99': m.latency.quantile(.99),
+                            'buckets': dict(zip(map(str, m.latency.bounds + (float('inf'),)), m.latency.counts)),
+                        },
+                    }
+                    for name, m in self.operations.items()
+                },
+            }
+
+    def prometheus(self) -> str:
+        p = self.prefix
+        lines = [
+            f'# HELP {p}_request_duration_seconds GraphQL request latency',
+            f'# TYPE {p}_request_duration_seconds histogram',
+        ]
+        with self.lock:
+            ops = list(self.operations.items())
+            for name, m in ops:
+                n = 0
+                for bound, c in zip(m.latency.bounds + (float('inf'),), m.latency.counts):
+                    n += c
+                    le = '+Inf' if bound == float('inf') else bound
+                    lines.append(f'{p}_request_duration_seconds_bucket{{operation="{name}",le="{le}"}} {n}')
+                lines.append(f'{p}_request_duration_seconds_sum{{operation="{name}"}} {m.latency.sum}')
+                lines.append(f'{p}_request_duration_seconds_count{{operation="{name}"}} {m.latency.count}')
+            for metric, kind, doc, get in (
+                    ('responses_total', 'counter', 'GraphQL responses by status class', None),
+                    ('response_bytes_total', 'counter', 'GraphQL response bytes received', lambda m: m.bytes_in),
+                    ('pages_total', 'counter', 'GraphQL pages returned, including cache hits', lambda m: m.pages),
+                    ('retries_total', 'counter', 'GraphQL request retries', lambda m: m.retries),
+                    ('cache_hits_total', 'counter', 'GraphQL pages served from the response cache', lambda m: m.cache_hits),
+                    ('coalesced_total', 'counter', 'GraphQL requests saved by joining an identical in-flight request', lambda m: m.coalesced),
+                    ('rate_limit_remaining', 'gauge', 'Last seen x-rate-limit-remaining', lambda m: m.rate_limit.get('remaining')),
+            ):
+                lines += [f'# HELP {p}_{metric} {doc}', f'# TYPE {p}_{metric} {kind}']
+                for name, m in ops:
+                    if get is None:
+                        lines += [f'{p}_{metric}{{operation="{name}",status="{k}"}} {v}' for k, v in m.status.items()]
+                    elif (v := get(m)) is not None:
+                        lines.append(f'{p}_{metric}{{operation="{name}"}} {v}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Metrics()
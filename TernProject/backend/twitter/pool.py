@@ -0,0 +1,178 @@
+import time
+from logging import Logger
+from pathlib import Path
+
+import orjson
+from httpx import AsyncClient, Client, Response
+
+from .constants import AUTH_ERROR_CODES, RED, RESET
+from .login import login
+from .ratelimit import RateLimiter
+from .util import get_headers
+
+
+class PoolAccount:
+    """ A single authenticated session and its rate-limit state """
+    __slots__ = ('session', 'headers', 'rate_limiter', 'inflight', 'active', 'error')
+
+    def __init__(self, session: Client):
+        self.session = session
+        self.headers = get_headers(session)
+        self.rate_limiter = RateLimiter()
+        self.inflight = 0
+        self.active = True
+        self.error = None
+
+    @property
+    def name(self) -> str:
+        return self.session.cookies.get('username') or self.session.cookies.get('twid', '')
+
+    def load(self, name: str) -> tuple:
+        """ Sort key for least-loaded selection """
+        bucket = self.rate_limiter[name]
+        return bucket.delay(time.time()), self.inflight, -bucket.remaining
+
+
+class SessionPool:
+    """
+    Spread paginated GraphQL reads across several accounts.
+
+    Each account keeps its own per-operation rate-limit buckets, requests go to the account
+    that can serve them soonest, and accounts that hit auth or lock errors are taken out of rotation.
+
+    @param sessions: list of cookie files, cookie dicts, (email, username, password) tuples or authenticated `Client`s
+    """
+
+    def __init__(self, sessions: list, logger: Logger = None, **kwargs):
+        self.accounts = [PoolAccount(self._load(s, **kwargs)) for s in sessions]
+        if not self.accounts:
+            raise Exception('Session pool is empty')
+        self.logger = logger
+
+    def __len__(self) -> int:
+        return len(self.active)
+
+    @property
+    def active(self) -> list[PoolAccount]:
+        return [a for a in self.accounts if a.active]
+
+    @property
+    def session(self) -> Client:
+        """ Primary session, used for anything that is not spread across the pool """
+        return self.accounts[0].session
+
+    @staticmethod
+    def _load(s: any, **kwargs) -> Client:
+        if isinstance(s, Client):
+            session = s
+        elif isinstance(s, (tuple, list)):
+            session = login(*s, **kwargs)
+            session._init_with_cookies = False
+            return session
+        elif isinstance(s, dict):
+            session = Client(cookies=s, follow_redirects=True)
+        elif isinstance(s, (str, Path)):
+            session = Client(cookies=orjson.loads(Path(s).read_bytes()), follow_redirects=True)
+        else:
+            raise Exception(f'Unsupported session type: {type(s)}')
+        if not all(session.cookies.get(c) for c in {'ct0', 'auth_token'}):
+            raise Exception('Session not authenticated, `ct0` and `auth_token` cookies are required.')
+        session._init_with_cookies = True
+        return session
+
+    def select(self, name: str) -> PoolAccount:
+        """ Least-loaded account for operation `name` """
+        if not (active := self.active):
+            raise Exception(f'[{RED}error{RESET}] No active accounts left in session pool')
+        return min(active, key=lambda a: a.load(name))
+
+    async def acquire(self, name: str) -> PoolAccount:
+        account = self.select(name)
+        account.inflight += 1
+        await account.rate_limiter.acquire(name)
+        return account
+
+    def acquire_sync(self, name: str) -> PoolAccount:
+        account = self.select(name)
+        account.inflight += 1
+        if t := account.rate_limiter[name].reserve(time.time()):
+            time.sleep(t)
+        return account
+
+    async def send(self, client: AsyncClient, name: str, url: str, metrics=None, **kwargs) -> Response:
+        """
+        Send a read from the least-loaded account. An account taken out of rotation by the response is
+        replaced by the next one and the request is sent again, until no accounts are left.
+
+        @param client: client shared by the accounts, each request carries its account's headers
+        @param name: operation name
+        @param url: request url
+        @param metrics: metrics registry the request is recorded in
+        @return: response
+        """
+        while True:
+            account = await self.acquire(name)
+            r = None
+            try:
+                start = time.perf_counter()
+                r = await client.get(url, headers=account.headers, **kwargs)
+                if metrics:
+                    metrics.observe(name, r, time.perf_counter() - start)
+            finally:
+                self.release(account, name, r)
+            if account.active or not self.active:
+                return r
+            if metrics:
+                metrics.retry(name)
+
+    def send_sync(self, method: str, name: str, url: str, metrics=None, **kwargs) -> Response:
+        """ Blocking `send`, each account uses its own session """
+        while True:
+            account = self.acquire_sync(name)
+            r = None
+            try:
+                start = time.perf_counter()
+                r = account.session.request(method=method, url=url, headers=account.headers, **kwargs)
+                if metrics:
+                    metrics.observe(name, r, time.perf_counter() - start)
+            finally:
+                self.release(account, name, r)
+            if account.active or not self.active:
+                return r
+            if metrics:
+                metrics.retry(name)
+
+    def release(self, account: PoolAccount, name: str, r: Response | None):
+        account.inflight -= 1
+        if r is None:
+            return
+        account.rate_limiter.update(name, r.headers, r.status_code)
+        if error := self._auth_error(r):
+            account.active = False
+            account.error = error
+            if self.logger:
+                self.logger.warning(f'[{RED}error{RESET}] Removing {account.name} from session pool: {error}')
+
+    @staticmethod
+    def _auth_error(r: Response) -> str | None:
+        if r.status_code not in {401, 403}:
+            return
+        try:
+            errors = r.json().get('errors', [])
+        except Exception:
+            errors = []
+        for e in errors:
+            if e.get('code') in AUTH_ERROR_CODES:
+                return f'{r.status_code} {e.get("code")} {e.get("message")}'
+        if r.status_code == 401:
+            return f'{r.status_code} {r.reason_phrase}'
+
+
+def init_pool(logger: Logger = None, **kwargs) -> SessionPool | None:
+    """ Build the session pool from the `pool` keyword argument, if any """
+    if (pool := kwargs.get('pool')) is None:
+        return
+    if not isinstance(pool, SessionPool):
+        pool = SessionPool(pool, **kwargs)
+    pool.logger = pool.logger or logger
+    return pool
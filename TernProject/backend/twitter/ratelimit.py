@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+from .constants import MAX_ENDPOINT_LIMIT, RATE_LIMIT_WINDOW
+
+
+class Bucket:
+    """
+    Token bucket for a single GraphQL operation.
+
+    Tokens are reserved ahead of time: once the current window is exhausted, callers are
+    scheduled into the next window(s) instead of being dropped. The bucket starts from
+    `MAX_ENDPOINT_LIMIT` and is corrected by the `x-rate-limit-*` headers of every response.
+    """
+    __slots__ = ('limit', 'remaining', 'reset', 'window')
+
+    def __init__(self, limit: int = MAX_ENDPOINT_LIMIT, window: int = RATE_LIMIT_WINDOW):
+        self.limit = limit
+        self.remaining = limit
+        self.reset = 0  # unknown until the first request is made
+        self.window = window
+
+    def _roll(self, now: float):
+        if not self.reset:
+            self.reset = now + self.window
+        elif now >= self.reset:
+            n = int((now - self.reset) // self.window) + 1
+            self.reset += n * self.window
+            self.remaining = min(self.limit, self.remaining + n * self.limit)
+
+    def delay(self, now: float) -> float:
+        """ Seconds until the next token is available """
+        self._roll(now)
+        if self.remaining > 0:
+            return 0
+        # remaining <= 0 means tokens were already reserved from future windows
+        return max(0, self.reset + (-self.remaining // self.limit) * self.window - now)
+
+    def reserve(self, now: float) -> float:
+        """ Reserve a token, returning the number of seconds to wait before using it """
+        d = self.delay(now)
+        self.remaining -= 1
+        return d
+
+    def update(self, headers: dict):
+        try:
+            limit = int(headers['x-rate-limit-limit'])
+            remaining = int(headers['x-rate-limit-remaining'])
+            reset = int(headers['x-rate-limit-reset'])
+        except (KeyError, ValueError):
+            return
+        if reset <= time.time():
+            return  # stale response from a window that is already over
+        self.limit = max(limit, 1)
+        self.reset = reset
+        # never trust local accounting over the server, in-flight requests may not be counted yet
+        self.remaining = min(self.remaining, remaining)
+
+
+class RateLimiter:
+    """
+    Per-operation pacing based on the live `x-rate-limit-*` headers.
+
+    Usage:
+        await limiter.acquire(name)
+        r = await client.get(...)
+        limiter.update(name, r.headers)
+    """
+
+    def __init__(self, limit: int = MAX_ENDPOINT_LIMIT, window: int = RATE_LIMIT_WINDOW):
+        self.limit = limit
+        self.window = window
+        self.buckets = {}
+
+    def __getitem__(self, name: str) -> Bucket:
+        if name not in self.buckets:
+            self.buckets[name] = Bucket(self.limit, self.window)
+        return self.buckets[name]
+
+    def delay(self, name: str) -> float:
+        return self[name].delay(time.time())
+
+    async def acquire(self, name: str) -> float:
+        """
+        Wait until a request for `name` may be sent
+
+        @param name: operation name
+        @return: seconds spent waiting
+        """
+        if t := self[name].reserve(time.time()):
+            await asyncio.sleep(t)
+        return t
+
+    def update(self, name: str, headers: dict, status: int = 200):
+        bucket = self[name]
+        bucket.update(headers)
+        if status == 429:
+            bucket.remaining = min(bucket.remaining, 0)
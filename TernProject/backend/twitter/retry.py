@@ -0,0 +1,152 @@
+import asyncio
+import random
+import time
+from dataclasses import dataclass, field
+
+from httpx import Response
+
+from .constants import MAX_RATE_LIMIT_RETRIES, RATE_LIMIT_WINDOW
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+@dataclass
+class Failure:
+    """ A request that could not be completed, returned instead of raising so concurrent queries keep running """
+    operation: str
+    reason: str  # 'status' | 'errors' | 'exception' | 'empty' | 'circuit_open'
+    status: int | None = None
+    error: str | None = None
+    retry_at: float | None = None  # earliest time the endpoint is expected to accept requests again
+    query: dict | None = None
+    time: float = field(default_factory=time.time)
+
+    def __bool__(self) -> bool:
+        return False
+
+
+class CircuitBreaker:
+    """
+    Per-endpoint circuit breaker.
+
+    After `threshold` consecutive failures, or a rate limit whose reset is further away than the retry policy
+    will wait, the circuit opens and requests fail fast until it is due to close. The first request after that
+    is a probe: success closes the circuit, failure opens it again. Requests arriving while the probe is in
+    flight wait for its result, see `acquire`.
+    """
+    __slots__ = ('threshold', 'cooldown', 'failures', 'until', 'probing', 'settled')
+
+    def __init__(self, threshold: int = 5, cooldown: float = 60):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.until = 0
+        self.probing = False
+        self.settled = None  # set once the probe in flight succeeds or fails
+
+    @property
+    def open(self) -> bool:
+        return self.until > time.time()
+
+    def allow(self) -> bool:
+        if self.open:
+            return False
+        if self.until and self.probing:
+            return False  # one probe at a time once the circuit is half-open
+        if self.until:
+            self.probing = True
+            self.settled = asyncio.Event()
+        return True
+
+    async def acquire(self) -> bool:
+        """ Like `allow`, but waits for the probe in flight instead of failing while the circuit is half-open """
+        while self.probing and not self.open:
+            await self.settled.wait()
+        return self.allow()
+
+    def _settle(self):
+        self.probing = False
+        if self.settled:
+            self.settled.set()
+            self.settled = None
+
+    def success(self):
+        self.failures = 0
+        self.until = 0
+        self._settle()
+
+    def failure(self, until: float = None):
+        self.failures += 1
+        self._settle()
+        if until or self.failures >= self.threshold or self.until:
+            self.until = max(until or 0, time.time() + self.cooldown)
+
+
+class RetryPolicy:
+    """
+    Retry policy shared by `Search` and `Scraper`.
+
+    Waits for `Retry-After` or `x-rate-limit-reset` when the server sends them, and falls back to
+    exponential backoff with full jitter otherwise. Waits longer than `max_wait` are not slept through,
+    the endpoint's circuit is opened instead so other requests to it fail fast.
+
+    @param retries: maximum number of retries per request
+    @param base: base delay in seconds for exponential backoff
+    @param cap: maximum delay in seconds for exponential backoff
+    @param max_wait: longest server-requested wait (seconds) to sleep through
+    @param threshold: consecutive failures before an endpoint's circuit opens
+    @param cooldown: seconds an open circuit stays open
+    """
+
+    def __init__(self, retries: int = MAX_RATE_LIMIT_RETRIES, base: float = 1, cap: float = 60,
+                 max_wait: float = RATE_LIMIT_WINDOW, threshold: int = 5, cooldown: float = 60):
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+        self.max_wait = max_wait
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.breakers = {}
+
+    def breaker(self, name: str) -> CircuitBreaker:
+        if name not in self.breakers:
+            self.breakers[name] = CircuitBreaker(self.threshold, self.cooldown)
+        return self.breakers[name]
+
+    @staticmethod
+    def retryable(r: Response) -> bool:
+        return r.status_code in RETRY_STATUS
+
+    @staticmethod
+    def retry_at(r: Response | None) -> float | None:
+        """ Time the server asked us to wait until, from `Retry-After` or `x-rate-limit-reset` """
+        if r is None:
+            return
+        if v := r.headers.get('retry-after'):
+            try:
+                return time.time() + float(v)
+            except ValueError:
+                from email.utils import parsedate_to_datetime
+
+                try:
+                    return parsedate_to_datetime(v).timestamp()
+                except (TypeError, ValueError):
+                    pass
+        if r.status_code == 429 or r.headers.get('x-rate-limit-remaining') == '0':
+            try:
+                return float(r.headers['x-rate-limit-reset'])
+            except (KeyError, ValueError):
+                pass
+
+    def delay(self, attempt: int, r: Response | None = None) -> float:
+        """ Seconds to wait before retry number `attempt` (0-based) """
+        if (t := self.retry_at(r)) is not None:
+            return max(0., t - time.time()) + random.random()
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+
+def init_retry(retry: RetryPolicy | dict | None) -> RetryPolicy:
+    """ Build the retry policy from the `retry` keyword argument """
+    if isinstance(retry, RetryPolicy):
+        return retry
+    return RetryPolicy(**(retry or {}))
@@ -1,46 +1,67 @@
 import asyncio
-import logging.config
+import logging
 import math
-import platform
 import sys
+from collections import deque
 from functools import partial
-from typing import Generator
+from typing import AsyncGenerator, Generator
 
-import websockets
 from httpx import AsyncClient, Limits, ReadTimeout, URL
-from tqdm.asyncio import tqdm_asyncio
 
 from .constants import *
+from .batch import TOO_LARGE, AdaptiveBatcher
+from .cache import init_cache
+from .checkpoint import init_checkpoints
+from .flight import init_flight
+from .ids import index_scope, init_idset, init_index, tweet_ids
 from .login import login
+from .metrics import registry
+from .pool import init_pool
+from .ratelimit import RateLimiter
+from .retry import Failure, init_retry
+from .segments import init_segments
+from .thread import ConversationTree, fetch_thread
+from .transport import init_http2
+from .users import init_user_cache, is_screen_name, users_in
 from .util import *
 
-try:
-    if get_ipython().__class__.__name__ == 'ZMQInteractiveShell':
-        import nest_asyncio
+websockets = LazyImport('websockets')
+tqdm_asyncio = LazyImport('tqdm.asyncio', 'tqdm_asyncio')
 
-        nest_asyncio.apply()
-except:
-    ...
 
-if platform.system() != 'Windows':
-    try:
-        import uvloop
-
-        uvloop.install()
-    except ImportError as e:
-        ...
-
-
-class Scraper:
+class Scraper(ClientMixin):
     def __init__(self, email: str = None, username: str = None, password: str = None, session: Client = None, **kwargs):
+        init_event_loop()
         self.save = kwargs.get('save', True)
         self.debug = kwargs.get('debug', 0)
         self.pbar = kwargs.get('pbar', True)
         self.out = Path(kwargs.get('out', 'data'))
+        self.gql_api = kwargs.get('gql_api', 'https://twitter.com/i/api/graphql')
         self.guest = False
         self.logger = self._init_logger(**kwargs)
-        self.session = self._validate_session(email, username, password, session, **kwargs)
+        self.pool = init_pool(self.logger, **kwargs)
+        self.session = self.pool.session if self.pool else self._validate_session(email, username, password, session, **kwargs)
         self.rate_limits = {}
+        self.rate_limiter = RateLimiter()
+        self.checkpoints = init_checkpoints(kwargs.get('checkpoint'), self.out / 'checkpoints.db')
+        self.cache = init_cache(kwargs.get('cache'), self.out / 'cache.db')
+        self.user_cache = init_user_cache(kwargs.get('user_cache'), self.out / 'users.db')
+        self.segments = init_segments(kwargs.get('segments'), self.out / 'segments')
+        self.incremental = kwargs.get('incremental', False)
+        self.retry_policy = init_retry(kwargs.get('retry'))
+        self.failures = []
+        self.batchers = {}
+        self.metrics = kwargs.get('metrics') or registry
+        self.flight = init_flight(kwargs.get('coalesce'), self.metrics)
+        self.index = init_index(self.incremental if kwargs.get('index') is None else kwargs['index'], self.out / 'ids.bin')
+        self.id_set = init_idset(kwargs.get('id_set'))
+        self.features = kwargs.get('features')  # see `FEATURE_PROFILES`
+        self.http2 = init_http2(kwargs.get('http2'))
+        self.http1 = kwargs.get('http1', True)
+        self.connections = kwargs.get('connections')  # default 2 over HTTP/2, `MAX_ENDPOINT_LIMIT` over HTTP/1.1
+        self.streams = kwargs.get('streams', 100)
+        self.transport = None
+        self._client = self._client_loop = self._loop = None
 
     def users(self, screen_names: list[str], **kwargs) -> list[dict]:
         """
@@ -50,7 +71,7 @@ class Scraper:
         @param kwargs: optional keyword arguments
         @return: list of user data as dicts
         """
-        return self._run(Operation.UserByScreenName, screen_names, **kwargs)
+        return self._sync(self.ausers(screen_names, **kwargs))
 
     def tweets_by_id(self, tweet_ids: list[int | str], **kwargs) -> list[dict]:
         """
@@ -60,7 +81,7 @@ class Scraper:
         @param kwargs: optional keyword arguments
         @return: list of tweet data as dicts
         """
-        return self._run(Operation.TweetResultByRestId, tweet_ids, **kwargs)
+        return self._sync(self.atweets_by_id(tweet_ids, **kwargs))
 
     def tweets_by_ids(self, tweet_ids: list[int | str], **kwargs) -> list[dict]:
         """
@@ -72,7 +93,7 @@ class Scraper:
         @param kwargs: optional keyword arguments
         @return: list of tweet data as dicts
         """
-        return self._run(Operation.TweetResultsByRestIds, batch_ids(tweet_ids), **kwargs)
+        return self._sync(self.atweets_by_ids(tweet_ids, **kwargs))
 
     def tweets_details(self, tweet_ids: list[int], **kwargs) -> list[dict]:
         """
@@ -84,7 +105,20 @@ class Scraper:
         @param kwargs: optional keyword arguments
         @return: list of tweet data as dicts
         """
-        return self._run(Operation.TweetDetail, tweet_ids, **kwargs)
+        return self._sync(self.atweets_details(tweet_ids, **kwargs))
+
+    def thread(self, tweet_id: int, **kwargs) -> ConversationTree:
+        """
+        Get the whole conversation of a tweet as a reply tree.
+
+        Every branch (more threads, more replies, replies deeper than the first page shows) is fetched
+        concurrently with `TweetDetail`, each cursor and each tweet at most once.
+
+        @param tweet_id: any tweet of the conversation
+        @param kwargs: `max_requests` (default 500), `concurrency` (default 8)
+        @return: conversation tree
+        """
+        return self._sync(self.athread(tweet_id, **kwargs))
 
     def tweets(self, user_ids: list[int], **kwargs) -> list[dict]:
         """
@@ -96,7 +130,7 @@ class Scraper:
         @param kwargs: optional keyword arguments
         @return: list of tweet data as dicts
         """
-        return self._run(Operation.UserTweets, user_ids, **kwargs)
+        return self._sync(self.atweets(user_ids, **kwargs))
 
     def tweets_and_replies(self, user_ids: list[int], **kwargs) -> list[dict]:
         """
@@ -108,7 +142,7 @@ class Scraper:
         @param kwargs: optional keyword arguments
         @return: list of tweet data as dicts
         """
-        return self._run(Operation.UserTweetsAndReplies, user_ids, **kwargs)
+        return self._sync(self.atweets_and_replies(user_ids, **kwargs))
 
     def media(self, user_ids: list[int], **kwargs) -> list[dict]:
         """
@@ -120,7 +154,7 @@ class Scraper:
         @param kwargs: optional keyword arguments
         @return: list of tweet data as dicts
         """
-        return self._run(Operation.UserMedia, user_ids, **kwargs)
+        return self._sync(self.amedia(user_ids, **kwargs))
 
     def likes(self, user_ids: list[int], **kwargs) -> list[dict]:
         """
@@ -132,7 +166,7 @@ class Scraper:
         @param kwargs: optional keyword arguments
         @return: list of tweet data as dicts
         """
-        return self._run(Operation.Likes, user_ids, **kwargs)
+        return self._sync(self.alikes(user_ids, **kwargs))
 
     def followers(self, user_ids: list[int], **kwargs) -> list[dict]:
         """
@@ -144,7 +178,7 @@ class Scraper:
         @param kwargs: optional keyword arguments
         @return: list of user data as dicts
         """
-        return self._run(Operation.Followers, user_ids, **kwargs)
+        return self._sync(self.afollowers(user_ids, **kwargs))
 
     def following(self, user_ids: list[int], **kwargs) -> list[dict]:
         """
@@ -156,7 +190,7 @@ class Scraper:
         @param kwargs: optional keyword arguments
         @return: list of user data as dicts
         """
-        return self._run(Operation.Following, user_ids, **kwargs)
+        return self._sync(self.afollowing(user_ids, **kwargs))
 
     def favoriters(self, tweet_ids: list[int], **kwargs) -> list[dict]:
         """
@@ -168,7 +202,7 @@ class Scraper:
         @param kwargs: optional keyword arguments
         @return: list of user data as dicts
         """
-        return self._run(Operation.Favoriters, tweet_ids, **kwargs)
+        return self._sync(self.afavoriters(tweet_ids, **kwargs))
 
     def retweeters(self, tweet_ids: list[int], **kwargs) -> list[dict]:
         """
@@ -180,7 +214,7 @@ class Scraper:
         @param kwargs: optional keyword arguments
         @return: list of user data as dicts
         """
-        return self._run(Operation.Retweeters, tweet_ids, **kwargs)
+        return self._sync(self.aretweeters(tweet_ids, **kwargs))
 
     def tweet_stats(self, user_ids: list[int], **kwargs) -> list[dict]:
         """
@@ -190,7 +224,7 @@ class Scraper:
         @param kwargs: optional keyword arguments
         @return: list of tweet statistics as dicts
         """
-        return self._run(Operation.TweetStats, user_ids, **kwargs)
+        return self._sync(self.atweet_stats(user_ids, **kwargs))
 
     def users_by_ids(self, user_ids: list[int], **kwargs) -> list[dict]:
         """
@@ -202,7 +236,7 @@ class Scraper:
         @param kwargs: optional keyword arguments
         @return: list of user data as dicts
         """
-        return self._run(Operation.UsersByRestIds, batch_ids(user_ids), **kwargs)
+        return self._sync(self.ausers_by_ids(user_ids, **kwargs))
 
     def recommended_users(self, user_ids: list[int] = None, **kwargs) -> list[dict]:
         """
@@ -212,11 +246,7 @@ class Scraper:
         @param kwargs: optional keyword arguments
         @return: list of recommended users data as dicts
         """
-        if user_ids:
-            contexts = [{"context": orjson.dumps({"contextualUserId": x}).decode()} for x in user_ids]
-        else:
-            contexts = [{'context': None}]
-        return self._run(Operation.ConnectTabTimeline, contexts, **kwargs)
+        return self._sync(self.arecommended_users(user_ids, **kwargs))
 
     def profile_spotlights(self, screen_names: list[str], **kwargs) -> list[dict]:
         """
@@ -229,7 +259,7 @@ class Scraper:
         @param kwargs: optional keyword arguments
         @return: list of user data as dicts
         """
-        return self._run(Operation.ProfileSpotlightsQuery, screen_names, **kwargs)
+        return self._sync(self.aprofile_spotlights(screen_names, **kwargs))
 
     def users_by_id(self, user_ids: list[int], **kwargs) -> list[dict]:
         """
@@ -243,7 +273,164 @@ class Scraper:
         @param kwargs: optional keyword arguments
         @return: list of user data as dicts
         """
-        return self._run(Operation.UserByRestId, user_ids, **kwargs)
+        return self._sync(self.ausers_by_id(user_ids, **kwargs))
+
+    def resolve(self, users: list[int | str]) -> list[int]:
+        """
+        Get user ids from screen names, via the user cache if enabled with `user_cache`.
+
+        Every operation that takes user ids also accepts screen names and resolves them this way.
+        Misses are fetched concurrently with `UserByScreenName`, 8 at a time. Ids (ints or all-digit strings) are
+        passed through, prefix all-digit screen names with `@`. Names that can't be resolved are dropped.
+
+        @param users: screen names and/or user ids
+        @return: list of user ids
+        """
+        return self._sync(self.aresolve(users))
+
+    def profiles(self, users: list[int | str]) -> list[dict]:
+        """
+        Get user results by user ids or screen names, via the user cache if enabled with `user_cache`.
+
+        Misses are fetched with the batched `UsersByRestIds` query.
+
+        @param users: screen names and/or user ids
+        @return: list of user results, in the order given
+        """
+        return self._sync(self.aprofiles(users))
+
+    async def ausers(self, screen_names: list[str], **kwargs) -> list[dict]:
+        """ Async version of `users` """
+        data = await self._arun(Operation.UserByScreenName, screen_names, **kwargs)
+        if self.user_cache:
+            self.user_cache.set(users_in(data))
+        return data
+
+    async def atweets_by_id(self, tweet_ids: list[int | str], **kwargs) -> list[dict]:
+        """ Async version of `tweets_by_id` """
+        return await self._arun(Operation.TweetResultByRestId, tweet_ids, **kwargs)
+
+    async def atweets_by_ids(self, tweet_ids: list[int | str], **kwargs) -> list[dict]:
+        """ Async version of `tweets_by_ids` """
+        return await self._batched(Operation.TweetResultsByRestIds, tweet_ids, **kwargs)
+
+    async def atweets_details(self, tweet_ids: list[int], **kwargs) -> list[dict]:
+        """ Async version of `tweets_details` """
+        return await self._arun(Operation.TweetDetail, tweet_ids, **kwargs)
+
+    async def athread(self, tweet_id: int, max_requests: int = 500, concurrency: int = 8) -> ConversationTree:
+        """ Async version of `thread` """
+        client = await self._get_client()
+        return await fetch_thread(self, client, int(tweet_id), max_requests, concurrency)
+
+    async def atweets(self, user_ids: list[int], **kwargs) -> list[dict]:
+        """ Async version of `tweets` """
+        return await self._arun(Operation.UserTweets, user_ids, **kwargs)
+
+    async def atweets_and_replies(self, user_ids: list[int], **kwargs) -> list[dict]:
+        """ Async version of `tweets_and_replies` """
+        return await self._arun(Operation.UserTweetsAndReplies, user_ids, **kwargs)
+
+    async def amedia(self, user_ids: list[int], **kwargs) -> list[dict]:
+        """ Async version of `media` """
+        return await self._arun(Operation.UserMedia, user_ids, **kwargs)
+
+    async def alikes(self, user_ids: list[int], **kwargs) -> list[dict]:
+        """ Async version of `likes` """
+        return await self._arun(Operation.Likes, user_ids, **kwargs)
+
+    async def afollowers(self, user_ids: list[int], **kwargs) -> list[dict]:
+        """ Async version of `followers` """
+        return await self._arun(Operation.Followers, user_ids, **kwargs)
+
+    async def afollowing(self, user_ids: list[int], **kwargs) -> list[dict]:
+        """ Async version of `following` """
+        return await self._arun(Operation.Following, user_ids, **kwargs)
+
+    async def afavoriters(self, tweet_ids: list[int], **kwargs) -> list[dict]:
+        """ Async version of `favoriters` """
+        return await self._arun(Operation.Favoriters, tweet_ids, **kwargs)
+
+    async def aretweeters(self, tweet_ids: list[int], **kwargs) -> list[dict]:
+        """ Async version of `retweeters` """
+        return await self._arun(Operation.Retweeters, tweet_ids, **kwargs)
+
+    async def atweet_stats(self, user_ids: list[int], **kwargs) -> list[dict]:
+        """ Async version of `tweet_stats` """
+        return await self._arun(Operation.TweetStats, user_ids, **kwargs)
+
+    async def ausers_by_ids(self, user_ids: list[int], **kwargs) -> list[dict]:
+        """ Async version of `users_by_ids` """
+        data = await self._batched(Operation.UsersByRestIds, await self.aresolve(user_ids), **kwargs)
+        if self.user_cache:
+            self.user_cache.set(users_in(data))
+        return data
+
+    async def arecommended_users(self, user_ids: list[int] = None, **kwargs) -> list[dict]:
+        """ Async version of `recommended_users` """
+        if user_ids:
+            contexts = [{"context": orjson.dumps({"contextualUserId": x}).decode()} for x in user_ids]
+        else:
+            contexts = [{'context': None}]
+        return await self._arun(Operation.ConnectTabTimeline, contexts, **kwargs)
+
+    async def aprofile_spotlights(self, screen_names: list[str], **kwargs) -> list[dict]:
+        """ Async version of `profile_spotlights` """
+        return await self._arun(Operation.ProfileSpotlightsQuery, screen_names, **kwargs)
+
+    async def ausers_by_id(self, user_ids: list[int], **kwargs) -> list[dict]:
+        """ Async version of `users_by_id` """
+        return await self._arun(Operation.UserByRestId, user_ids, **kwargs)
+
+    async def aresolve(self, users: list[int | str], concurrency: int = 8) -> list[int]:
+        """ Async version of `resolve` """
+        names = [x for x in users if is_screen_name(x)]
+        ids = self.user_cache.ids(names) if names and self.user_cache else {}
+        # one request per account, however its name is spelled
+        if missing := list(dict.fromkeys(x.lstrip('@').lower() for x in names if x not in ids)):
+            client = await self._get_client()
+            sem = asyncio.Semaphore(concurrency)
+
+            async def get(screen_name: str):
+                async with sem:
+                    return await self._query(client, Operation.UserByScreenName, screen_name=screen_name)
+
+            responses = await asyncio.gather(*(get(x) for x in missing))
+            found = []
+            for r in responses:
+                if isinstance(r, Failure):
+                    self._failed(r)
+                    continue
+                try:
+                    found += users_in(r.json())
+                except Exception as e:
+                    if self.debug:
+                        self.logger.error(f'Failed to parse user\n{e}')
+            if self.user_cache:
+                self.user_cache.set(found)
+            by_name = {u['legacy']['screen_name'].lower(): int(u['rest_id']) for u in found}
+            ids |= {x: by_name[name] for x in names if (name := x.lstrip('@').lower()) in by_name}
+        res = []
+        for x in users:
+            if not is_screen_name(x):
+                res.append(int(x))
+            elif x in ids:
+                res.append(ids[x])
+            elif self.debug:
+                self.logger.warning(f'{YELLOW}Could not resolve screen name {x}{RESET}')
+        return res
+
+    async def aprofiles(self, users: list[int | str]) -> list[dict]:
+        """ Async version of `profiles` """
+        user_ids = await self.aresolve(users)
+        profiles = self.user_cache.profiles(user_ids) if self.user_cache else {}
+        if missing := [x for x in dict.fromkeys(user_ids) if x not in profiles]:
+            data = await self._batched(Operation.UsersByRestIds, missing)
+            found = users_in(data)
+            if self.user_cache:
+                self.user_cache.set(found)
+            profiles |= {int(u['rest_id']): u for u in found}
+        return [profiles[x] for x in user_ids if x in profiles]
 
     def download_media(self, ids: list[int], photos: bool = True, videos: bool = True, cards: bool = True, hq_img_variant: bool = True, video_thumb: bool = False, out: str = 'media',
                        metadata_out: str = 'media.json', **kwargs) -> dict:
@@ -570,30 +757,87 @@ class Scraper:
         return asyncio.run(process())
 
     def _run(self, operation: tuple[dict, str, str], queries: set | list[int | str | list | dict], **kwargs):
-        keys, qid, name = operation
-        # stay within rate-limits
-        if (l := len(queries)) > MAX_ENDPOINT_LIMIT:
-            if self.debug:
-                self.logger.warning(f'Got {l} queries, truncating to first 500.')
-            queries = list(queries)[:MAX_ENDPOINT_LIMIT]
+        return self._sync(self._arun(operation, queries, **kwargs))
 
-        if all(isinstance(q, dict) for q in queries):
-            data = asyncio.run(self._process(operation, list(queries), **kwargs))
-            return get_json(data, **kwargs)
+    async def _arun(self, operation: tuple[dict, str, str], queries: set | list[int | str | list | dict], **kwargs):
+        keys, qid, name = operation
+        # no truncation, requests past the rate-limit window are queued by `self.rate_limiter`
+        if self.debug and (l := len(queries)) > MAX_ENDPOINT_LIMIT:
+            self.logger.debug(f'Got {l} queries, requests past the rate-limit window will be queued.')
 
-        # queries are of type set | list[int|str], need to convert to list[dict]
-        _queries = [{k: q} for q in queries for k, v in keys.items()]
-        res = asyncio.run(self._process(operation, _queries, **kwargs))
-        data = get_json(res, **kwargs)
-        return data.pop() if kwargs.get('cursor') else flatten(data)
+        try:
+            if 'userId' in keys and not all(isinstance(q, dict) for q in queries):
+                queries = await self.aresolve(list(queries))
+            if all(isinstance(q, dict) for q in queries):
+                data = await self._process(operation, list(queries), **kwargs)
+                return get_json(data, **kwargs)
+
+            # queries are of type set | list[int|str], need to convert to list[dict]
+            _queries = [{k: q} for q in queries for k, v in keys.items()]
+            res = await self._process(operation, _queries, **kwargs)
+            data = get_json(res, **kwargs)
+            return data.pop() if kwargs.get('cursor') else flatten(data)
+        finally:
+            if self.index is not None:
+                self.index.save()
+
+    def _client_options(self) -> dict:
+        headers = self.session.headers if self.guest else get_headers(self.session)
+        return {'headers': headers, 'cookies': self.session.cookies, 'timeout': 20}
 
-    async def _query(self, client: AsyncClient, operation: tuple, **kwargs) -> Response:
+    async def _query(self, client: AsyncClient, operation: tuple, features: str | dict = None, **kwargs) -> CachedResponse | Failure:
         keys, qid, name = operation
-        params = {
+        query = {
             'variables': Operation.default_variables | keys | kwargs,
-            'features': Operation.default_features,
+            'features': get_features(self.features if features is None else features, name),
         }
-        r = await client.get(f'https://twitter.com/i/api/graphql/{qid}/{name}', params=build_params(params))
+        url = f'{self.gql_api}/{qid}/{name}'
+        params = build_params(query)
+        if self.cache and (r := self.cache.get(name, url, qid, params)):
+            self.metrics.cached(name)
+            if self.save:
+                await self._save(r, name, **kwargs)
+            return r
+        if self.flight is None:
+            return await self._fetch(client, operation, url, params, **kwargs)
+        # identical requests already in flight share the response, only the first caller saves it
+        return await self.flight.do(name, query, partial(self._fetch, client, operation, url, params, **kwargs))
+
+    async def _fetch(self, client: AsyncClient, operation: tuple, url: str, params: dict, **kwargs) -> CachedResponse | Failure:
+        """ Send the request with retries, then cache, log and save the response """
+        _, qid, name = operation
+        policy = self.retry_policy
+        breaker = policy.breaker(name)
+        for i in range(policy.retries + 1):
+            if not await breaker.acquire():
+                return Failure(name, 'circuit_open', retry_at=breaker.until, query=kwargs)
+            try:
+                r = await self._get(client, name, url, params)
+            except Exception as e:
+                breaker.failure()
+                if i == policy.retries:
+                    return Failure(name, 'exception', error=f'{e!r}', query=kwargs)
+                self.metrics.retry(name)
+                await asyncio.sleep(policy.delay(i))
+                continue
+            if not policy.retryable(r):
+                breaker.success()
+                break
+            if (t := policy.delay(i, r)) > policy.max_wait:
+                breaker.failure(until=policy.retry_at(r))
+                if self.debug:
+                    self.logger.warning(f'{YELLOW}{name} unavailable for {t:.0f}s, opening circuit{RESET}')
+                return Failure(name, 'status', status=r.status_code, retry_at=breaker.until, query=kwargs)
+            breaker.failure()
+            if i == policy.retries:
+                return Failure(name, 'status', status=r.status_code, query=kwargs)
+            if self.debug:
+                self.logger.warning(f'{YELLOW}{r.status_code} on {name}, retrying in {t:.2f}s{RESET}')
+            self.metrics.retry(name)
+            await asyncio.sleep(t)
+        r = CachedResponse(r)
+        if self.cache:
+            self.cache.set(name, qid, params, r)
 
         try:
             self.rate_limits[name] = {k: int(v) for k, v in r.headers.items() if 'rate-limit' in k}
@@ -603,62 +847,297 @@ class Scraper:
         if self.debug:
             log(self.logger, self.debug, r)
         if self.save:
-            await save_json(r, self.out, name, **kwargs)
+            await self._save(r, name, **kwargs)
         return r
 
+    async def _save(self, r: CachedResponse, name: str, **kwargs):
+        """ Append the page to the segment writer if enabled, otherwise write one file per response """
+        if not self.segments:
+            return await save_json(r, self.out, name, **kwargs)
+        try:
+            r.json()  # only save valid JSON
+            self.segments.write(r.content, name, kwargs)
+        except Exception as e:
+            if self.debug:
+                self.logger.debug(f'Failed to save JSON data for {kwargs}\n{e}')
+
+    async def _get(self, client: AsyncClient, name: str, url: str, params: dict) -> Response:
+        """ Send a GraphQL read, paced by the rate limiter or spread across the session pool """
+        if not self.pool:
+            await self.rate_limiter.acquire(name)
+            start = time.perf_counter()
+            r = await client.get(url, params=params)
+            self.metrics.observe(name, r, time.perf_counter() - start)
+            self.rate_limiter.update(name, r.headers, r.status_code)
+            return r
+        return await self.pool.send(client, name, url, self.metrics, params=params)
+
+    async def _batched(self, operation: tuple, ids: list[int | str], concurrency: int = 8, **kwargs) -> list[dict]:
+        """
+        Hydrate ids with a `*ByRestIds` batch operation, see `AdaptiveBatcher`
+
+        Batches rejected as too large are re-packed with a smaller budget and retried, or halved once the budget is at
+        its floor. A single id still rejected is recorded as a failure. Ids missing from a truncated
+        response are re-queued once. Batches are sent in rounds of `concurrency`, the first round is a
+        single batch so the batch size can be learned before fanning out.
+
+        @param operation: `Operation.TweetResultsByRestIds` or `Operation.UsersByRestIds`
+        @param ids: tweet or user ids
+        @param concurrency: batches in flight at once
+        @return: list of response data as dicts, one per batch
+        """
+        keys, qid, name = operation
+        key = next(iter(keys))
+        # everything else in `kwargs` (limit, save, ...) is not a GraphQL variable
+        features = kwargs.get('features')
+        batcher = self.batchers.setdefault(name, AdaptiveBatcher())
+        queue = deque(dict.fromkeys(map(str, ids)))
+        split = deque()  # halves of rejected batches the budget can no longer shrink
+        requeued = set()
+        client = await self._get_client()
+        res = []
+        width = 1
+        while queue or split:
+            batches = [b for _ in range(width) if (b := split.popleft() if split else batcher.take(queue))]
+            responses = await asyncio.gather(*(self._query(client, operation, features=features, **{key: b}) for b in batches))
+            for batch, r in zip(batches, responses):
+                if isinstance(r, Failure):
+                    self._failed(r)
+                    continue
+                if r.status_code in TOO_LARGE:
+                    batcher.too_large(batch)
+                    if self.debug:
+                        self.logger.debug(f'{name}: {r.status_code} for {len(batch)} ids, batch budget now {batcher.budget}')
+                    if len(batch) == 1:
+                        self._failed(Failure(name, 'status', status=r.status_code, query={key: batch}))
+                    elif batcher.size(batch) > batcher.budget:  # back to the front, re-packed with the smaller budget
+                        queue.extendleft(reversed(batch))
+                    else:  # the budget is at its floor, halve the batch down to single ids
+                        split.extend((batch[:len(batch) // 2], batch[len(batch) // 2:]))
+                    continue
+                try:
+                    data = r.json()
+                except Exception as e:
+                    self._failed(Failure(name, 'status', status=r.status_code, error=f'{e!r}', query={key: batch}))
+                    continue
+                slots = next((v for v in (data.get('data') or {}).values() if isinstance(v, list)), None)
+                batcher.success(batch, len(slots) if slots is not None else None)
+                res.append(data)
+                if slots is not None and len(slots) < len(batch):
+                    # truncated response, ids with an empty slot were deleted or suspended and are not retried
+                    found = set(find_key(data, 'rest_id'))
+                    missing = [x for x in batch if x not in found and x not in requeued]
+                    requeued |= set(missing)
+                    queue.extend(missing)
+            width = concurrency
+        if self.debug:
+            self.logger.debug(f'{name}: batch budget {batcher.budget} chars, max {batcher.max_count or "-"} ids')
+        return res
+
     async def _process(self, operation: tuple, queries: list[dict], **kwargs):
-        headers = self.session.headers if self.guest else get_headers(self.session)
-        cookies = self.session.cookies
-        async with AsyncClient(limits=Limits(max_connections=MAX_ENDPOINT_LIMIT), headers=headers, cookies=cookies, timeout=20) as c:
-            tasks = (self._paginate(c, operation, **q, **kwargs) for q in queries)
-            if self.pbar:
-                return await tqdm_asyncio.gather(*tasks, desc=operation[-1])
-            return await asyncio.gather(*tasks)
+        c = await self._get_client()
+        tasks = (self._paginate(c, operation, **q, **kwargs) for q in queries)
+        if self.pbar:
+            return await tqdm_asyncio.gather(*tasks, desc=operation[-1])
+        return await asyncio.gather(*tasks)
 
     async def _paginate(self, client: AsyncClient, operation: tuple, **kwargs):
+        res, cursor = [], None
+        async for r, _, cursor in self._pages(client, operation, **kwargs):
+            res.append(r)
+        if kwargs.get('cursor'):
+            return res, cursor
+        return res
+
+    async def _pages(self, client: AsyncClient, operation: tuple, **kwargs) -> AsyncGenerator[tuple[Response, dict, str], None]:
+        """
+        Yield (response, parsed data, next cursor) for each page of a timeline as soon as it arrives.
+
+        Only the current page is held in memory. If a checkpoint store is configured, progress is
+        recorded after every page, completed queries are skipped and partial ones resume from their last cursor.
+        """
         limit = kwargs.pop('limit', math.inf)
         cursor = kwargs.pop('cursor', None)
-        is_resuming = False
+        features = kwargs.pop('features', None)
+        name = operation[-1]
         dups = 0
         DUP_LIMIT = 3
-        if cursor:
-            is_resuming = True
-            res = []
-            ids = set()
-        else:
+        ids = self.id_set()
+        seen = pages = 0  # carried over from a previous run
+        # in incremental mode a completed query starts over from the newest page, the id index decides where to stop
+        if (self.checkpoints and not cursor and (cp := self.checkpoints.get(name, kwargs))
+                and not (cp['done'] and self.incremental)):
+            if cp['done']:
+                if self.debug:
+                    self.logger.debug(f'Skipping completed query {name} {kwargs}')
+                return
+            cursor, seen, pages = cp['cursor'], cp['seen'], cp['pages']
+            if self.debug:
+                self.logger.debug(f'Resuming {name} {kwargs} from page {pages}')
+        if not cursor:
             try:
-                r = await self._query(client, operation, **kwargs)
-                initial_data = r.json()
-                res = [r]
-                ids = {x for x in find_key(initial_data, 'rest_id') if x[0].isnumeric()}
-
-                cursor = get_cursor(initial_data)
+                r = await self._query(client, operation, features=features, **kwargs)
+                if isinstance(r, Failure):
+                    self._failed(r)
+                    return
+                data = r.json()
+                found = find_keys(data, 'rest_id', 'entries')
+                ids.update(int(x) for x in found['rest_id'] if x.isdigit())
+                cursor = get_cursor(data, found['entries'])
+                known = self._known(found['entries'], name, kwargs)
             except Exception as e:
+                self._failed(Failure(name, 'exception', error=f'{e!r}', query=kwargs))
                 if self.debug:
                     self.logger.error(f'Failed to get initial pagination data: {e}')
                 return
+            yield r, data, cursor
+            pages += 1
+            if known:
+                cursor = None
+            if self.checkpoints:
+                self.checkpoints.save(name, kwargs, cursor, len(ids) + seen, pages)
         while (dups < DUP_LIMIT) and cursor:
             prev_len = len(ids)
-            if prev_len >= limit:
+            if prev_len + seen >= limit:
                 break
             try:
-                r = await self._query(client, operation, cursor=cursor, **kwargs)
+                r = await self._query(client, operation, cursor=cursor, features=features, **kwargs)
+                if isinstance(r, Failure):
+                    self._failed(r)
+                    return
                 data = r.json()
             except Exception as e:
+                self._failed(Failure(name, 'exception', error=f'{e!r}', query=kwargs))
                 if self.debug:
                     self.logger.error(f'Failed to get pagination data\n{e}')
                 return
-            cursor = get_cursor(data)
-            ids |= {x for x in find_key(data, 'rest_id') if x[0].isnumeric()}
+            found = find_keys(data, 'rest_id', 'entries')
+            cursor = get_cursor(data, found['entries'])
+            ids.update(int(x) for x in found['rest_id'] if x.isdigit())
+            known = self._known(found['entries'], name, kwargs)
 
             if self.debug:
                 self.logger.debug(f'Unique results: {len(ids)}\tcursor: {cursor}')
             if prev_len == len(ids):
                 dups += 1
-            res.append(r)
-        if is_resuming:
-            return res, cursor
-        return res
+            yield r, data, cursor
+            pages += 1
+            if known:
+                if self.debug:
+                    self.logger.debug(f'Reached previously crawled tweets for {name} {kwargs}')
+                cursor = None
+                break
+            if self.checkpoints:
+                self.checkpoints.save(name, kwargs, cursor, len(ids) + seen, pages)
+        # stopped at `limit` or on repeated pages: keep the cursor, a later run can continue from it
+        if self.checkpoints and not cursor:
+            self.checkpoints.complete(name, kwargs, len(ids) + seen, pages)
+
+    def _failed(self, failure: Failure):
+        """ Record a failed request, the checkpoint is kept so the query can be resumed """
+        self.failures.append(failure)
+        if self.debug:
+            self.logger.error(f'[{RED}error{RESET}] {failure.operation} {failure.query} failed: {failure.reason} {failure.status or failure.error or ""}')
+
+    def _known(self, entries: list[list[dict]], name: str, query: dict) -> bool:
+        """ Record the tweet ids of a page, True if in incremental mode and this query saw all of them in earlier runs """
+        if self.index is None:
+            return False
+        _ids = tweet_ids([e for x in entries for e in x])
+        scope = index_scope(name, query)
+        known = bool(_ids) and self.index.known(_ids, scope)
+        self.index.update(_ids, scope)
+        return self.incremental and known
+
+    async def aiter(self, operation: tuple, queries: set | list[int | str | dict], buffer: int = 64, concurrency: int = 32,
+                    **kwargs) -> AsyncGenerator[tuple[dict, dict], None]:
+        """
+        Stream parsed pages as they arrive.
+
+        Pages from all queries are interleaved in arrival order. At most `buffer + concurrency` pages are held
+        in memory at once, so downstream processing can start with the first page.
+
+        e.g.
+            async for query, page in scraper.aiter(Operation.Followers, user_ids):
+                ...
+
+        @param operation: operation to paginate, e.g. `Operation.Followers`
+        @param queries: list of ids/screen names, or list of variable dicts
+        @param buffer: number of parsed pages to hold before producers wait for the consumer
+        @param concurrency: number of queries paginated concurrently
+        @param kwargs: optional keyword arguments
+        @return: async generator of (query variables, page data)
+        """
+        keys, qid, name = operation
+        if not all(isinstance(q, dict) for q in queries):
+            if 'userId' in keys:
+                queries = await self.aresolve(list(queries))
+            queries = [{k: q} for q in queries for k, v in keys.items()]
+        it = iter(queries)
+        queue = asyncio.Queue(maxsize=buffer)
+        done = object()
+
+        async def worker(client: AsyncClient):
+            try:
+                for q in it:
+                    async for _, data, _ in self._pages(client, operation, **q, **kwargs):
+                        await queue.put((q, data))
+            except Exception as e:
+                if self.debug:
+                    self.logger.error(f'Failed to stream {name}\n{e}')
+            await queue.put(done)
+
+        c = await self._get_client()
+        n = min(concurrency, len(queries))
+        workers = [asyncio.create_task(worker(c)) for _ in range(n)]
+        try:
+            while n:
+                item = await queue.get()
+                if item is done:
+                    n -= 1
+                    continue
+                yield item
+        finally:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def aiter_entries(self, operation: tuple, queries: set | list[int | str | dict], **kwargs) -> AsyncGenerator[tuple[dict, dict], None]:
+        """
+        Stream timeline entries (tweets, users, conversation modules) as each page arrives.
+
+        Cursor entries are skipped.
+
+        @param operation: operation to paginate, e.g. `Operation.UserTweets`
+        @param queries: list of ids/screen names, or list of variable dicts
+        @param kwargs: optional keyword arguments, see `aiter`
+        @return: async generator of (query variables, entry)
+        """
+        async for q, data in self.aiter(operation, queries, **kwargs):
+            for entries in find_key(data, 'entries'):
+                for e in entries:
+                    if not e.get('entryId', '').startswith('cursor-'):
+                        yield q, e
+
+    def aiter_tweets(self, user_ids: list[int], **kwargs) -> AsyncGenerator[tuple[dict, dict], None]:
+        """ Stream tweets by user ids, see `aiter_entries` """
+        return self.aiter_entries(Operation.UserTweets, user_ids, **kwargs)
+
+    def aiter_followers(self, user_ids: list[int], **kwargs) -> AsyncGenerator[tuple[dict, dict], None]:
+        """ Stream followers by user ids, see `aiter_entries` """
+        return self.aiter_entries(Operation.Followers, user_ids, **kwargs)
+
+    def aiter_following(self, user_ids: list[int], **kwargs) -> AsyncGenerator[tuple[dict, dict], None]:
+        """ Stream following by user ids, see `aiter_entries` """
+        return self.aiter_entries(Operation.Following, user_ids, **kwargs)
+
+    def aiter_favoriters(self, tweet_ids: list[int], **kwargs) -> AsyncGenerator[tuple[dict, dict], None]:
+        """ Stream favoriters by tweet ids, see `aiter_entries` """
+        return self.aiter_entries(Operation.Favoriters, tweet_ids, **kwargs)
+
+    def aiter_retweeters(self, tweet_ids: list[int], **kwargs) -> AsyncGenerator[tuple[dict, dict], None]:
+        """ Stream retweeters by tweet ids, see `aiter_entries` """
+        return self.aiter_entries(Operation.Retweeters, tweet_ids, **kwargs)
 
     async def _space_listener(self, chat: dict, frequency: int):
         rand_color = lambda: random.choice([RED, GREEN, RESET, BLUE, CYAN, MAGENTA, YELLOW])
@@ -846,6 +1325,8 @@ class Scraper:
 
     def _init_logger(self, **kwargs) -> Logger:
         if kwargs.get('debug'):
+            import logging.config
+
             cfg = kwargs.get('log_config')
             logging.config.dictConfig(cfg or LOG_CONFIG)
 
@@ -1,57 +1,157 @@
 import asyncio
-import logging.config
+import logging
 import math
-import platform
-import random
 import re
 import time
+from functools import partial
 from logging import Logger
 from pathlib import Path
 
 import orjson
-from httpx import AsyncClient, Client
+from httpx import AsyncClient, Client, HTTPStatusError
 
 from .constants import *
+from .cache import init_cache
+from .checkpoint import init_checkpoints, init_watermarks
+from .flight import init_flight
+from .ids import IdSet, index_scope, init_idset, init_index, tweet_ids, user_ids
 from .login import login
-from .util import get_headers, find_key, build_params
+from .metrics import registry
+from .pool import init_pool
+from .retry import Failure, init_retry
+from .segments import init_segments
+from .transport import init_http2
+from .util import get_headers, find_key, find_keys, build_params, get_features, init_event_loop, CachedResponse, ClientMixin
+
+ENTRY_NUMBER = re.compile(r'^(?:tweet|user)-(\d+)$')  # id of a `tweet-` or `user-` entry
 
 reset = '\x1b[0m'
 colors = [f'\x1b[{i}m' for i in range(31, 37)]
 
-try:
-    if get_ipython().__class__.__name__ == 'ZMQInteractiveShell':
-        import nest_asyncio
-
-        nest_asyncio.apply()
-except:
-    ...
-
-if platform.system() != 'Windows':
-    try:
-        import uvloop
-
-        uvloop.install()
-    except ImportError as e:
-        ...
 
-
-class Search:
+class Search(ClientMixin):
     def __init__(self, email: str = None, username: str = None, password: str = None, session: Client = None, **kwargs):
+        init_event_loop()
         self.save = kwargs.get('save', True)
         self.debug = kwargs.get('debug', 0)
+        self.gql_api = kwargs.get('gql_api', 'https://twitter.com/i/api/graphql')
         self.logger = self._init_logger(**kwargs)
-        self.session = self._validate_session(email, username, password, session, **kwargs)
+        self.pool = init_pool(self.logger, **kwargs)
+        self.session = self.pool.session if self.pool else self._validate_session(email, username, password, session, **kwargs)
+        self.checkpoints = init_checkpoints(kwargs.get('checkpoint'), 'data/checkpoints.db')
+        self.cache = init_cache(kwargs.get('cache'), 'data/cache.db')
+        self.segments_option = kwargs.get('segments')  # `True` writes under the `out` of each run
+        self.segments = init_segments(self.segments_option, 'data/search_results/segments') if self.segments_option is not True else None
+        self.incremental = kwargs.get('incremental', False)
+        self.watermarks = init_watermarks(kwargs.get('watermark'), 'data/watermarks.db')
+        self.watermark_stats = {}
+        self.retry_policy = init_retry(kwargs.get('retry'))
+        self.failures = []
+        self.metrics = kwargs.get('metrics') or registry
+        self.flight = init_flight(kwargs.get('coalesce'), self.metrics)
+        self.index = init_index(self.incremental if kwargs.get('index') is None else kwargs['index'], 'data/ids.bin')
+        self.id_set = init_idset(kwargs.get('id_set'))
+        self.features = kwargs.get('features')  # see `FEATURE_PROFILES`
+        self.http2 = init_http2(kwargs.get('http2'))
+        self.http1 = kwargs.get('http1', True)
+        self.connections = kwargs.get('connections')  # default 2 over HTTP/2, `MAX_ENDPOINT_LIMIT` over HTTP/1.1
+        self.streams = kwargs.get('streams', 100)
+        self.transport = None
+        self._client = self._client_loop = self._loop = None
 
     def run(self, queries: list[dict], limit: int = math.inf, out: str = 'data/search_results', **kwargs):
+        return self._sync(self.arun(queries, limit, out, **kwargs))
+
+    async def arun(self, queries: list[dict], limit: int = math.inf, out: str = 'data/search_results', **kwargs):
+        """ Async version of `run` """
         out = Path(out)
         out.mkdir(parents=True, exist_ok=True)
-        return asyncio.run(self.process(queries, limit, out, **kwargs))
+        if self.segments_option is True and (self.segments is None or self.segments.out != out / 'segments'):
+            if self.segments:
+                await asyncio.to_thread(self.segments.close)
+            self.segments = init_segments(True, out / 'segments')
+        try:
+            return await self.process(queries, limit, out, **kwargs)
+        finally:
+            if self.index is not None:
+                self.index.save()
 
     async def process(self, queries: list[dict], limit: int, out: Path, **kwargs) -> list:
-        async with AsyncClient(headers=get_headers(self.session)) as s:
-            return await asyncio.gather(*(self.paginate(s, q, limit, out, **kwargs) for q in queries))
+        s = await self._get_client()
+        return await asyncio.gather(*(
+            self.fan_out(s, q, limit, out, **kwargs) if q.get('slices', kwargs.get('slices', 1)) > 1
+            else self.paginate(s, q, limit, out, **kwargs)
+            for q in queries
+        ))
+
+    async def fan_out(self, client: AsyncClient, query: dict, limit: int, out: Path, **kwargs) -> list[dict]:
+        """
+        Split one query into disjoint time windows and paginate them concurrently
+
+        Windows are bounded by `query['since']` and `query['until']` (date strings or unix timestamps),
+        or by `since:`/`until:` operators already in the query. Without a lower bound the last
+        `SEARCH_SLICE_LOOKBACK` seconds are searched.
+
+        e.g. {'category': 'Latest', 'query': 'crypto BTC bitcoin', 'since': '2024-01-01', 'slices': 8}
+
+        @param query: search query, `slices` is the number of windows
+        @return: merged results, deduplicated by entry id, newest first
+        """
+        n = query.get('slices', kwargs.pop('slices', 1))
+        base = {k: v for k, v in query.items() if k not in {'slices', 'since', 'until'}}
+        windows = self.time_slices(query['query'], n, query.get('since'), query.get('until'))
+        total = self.id_set()  # shared, so `limit` applies to the merged results
+        res = await asyncio.gather(*(
+            self.paginate(client, base | {'query': q}, limit, out, shared=total, **kwargs) for q in windows
+        ))
+        merged = {}
+        for e in (e for r in res for e in r):
+            e['query'] = query['query']
+            merged.setdefault(e['entryId'], e)
+        # snowflake ids are time-ordered
+        key = lambda e: int(m.group(1)) if (m := ENTRY_NUMBER.match(e['entryId'])) else 0
+        entries = sorted(merged.values(), key=key, reverse=True)
+        if self.debug:
+            self.logger.debug(f'[{GREEN}success{RESET}] Merged {len(entries)} search results from {n} windows for {query["query"]}')
+        return entries
+
+    @staticmethod
+    def time_slices(query: str, n: int, since: str | int | float = None, until: str | int | float = None) -> list[str]:
+        """
+        Split a search query into `n` contiguous, non-overlapping `since_time:`/`until_time:` windows
+
+        @param query: raw search query, `since:`/`until:` operators are used as bounds if given
+        @param n: number of windows
+        @param since: lower bound, date string (YYYY-MM-DD) or unix timestamp
+        @param until: upper bound, date string (YYYY-MM-DD) or unix timestamp, defaults to the next full hour
+        @return: list of queries, newest window first
+        """
+
+        from calendar import timegm
+
+        def ts(x: str | int | float) -> int:
+            if isinstance(x, int | float):
+                return int(x)
+            return int(timegm(time.strptime(x[:10], '%Y-%m-%d')))
+
+        for op in ('since', 'until'):
+            if m := re.search(rf'(?:^|\s){op}:(\S+)', query):
+                query = query.replace(m.group(), ' ').strip()
+                if op == 'since':
+                    since = since or m.group(1)
+                else:
+                    until = until or m.group(1)
+        # without `until`, end on the next full hour: windows, and so their checkpoints, stay the same across runs
+        end = ts(until) if until else -(-int(time.time()) // 3600) * 3600
+        start = ts(since) if since else end - SEARCH_SLICE_LOOKBACK
+        if start >= end:
+            raise Exception(f'Invalid time range for {query}: {since} - {until}')
+        step = (end - start) / n
+        bounds = [start + round(i * step) for i in range(n)] + [end]
+        return [f'{query} since_time:{bounds[i]} until_time:{bounds[i + 1]}' for i in reversed(range(n))]
 
-    async def paginate(self, client: AsyncClient, query: dict, limit: int, out: Path, **kwargs) -> list[dict]:
+    async def paginate(self, client: AsyncClient, query: dict, limit: int, out: Path, shared: IdSet | set = None,
+                       **kwargs) -> list[dict]:
         params = {
             'variables': {
                 'count': 20,
@@ -59,69 +159,191 @@ class Search:
                 'rawQuery': query['query'],
                 'product': query['category']
             },
-            'features': Operation.default_features,
+            'features': get_features(query.get('features', kwargs.get('features', self.features)), Operation.SearchTimeline[-1]),
             'fieldToggles': {'withArticleRichContentState': False},
         }
 
+        name = Operation.SearchTimeline[-1]
         res = []
         cursor = ''
-        total = set()
+        total = self.id_set()
+        seen = pages = 0  # carried over from a previous run
+        exhausted = False  # reached the end of the results, as opposed to `limit`
+        # when polling, a completed search starts over, the watermark or id index decides where to stop
+        if (self.checkpoints and (cp := self.checkpoints.get(name, query))
+                and not (cp['done'] and (self.watermarks or self.incremental))):
+            if cp['done']:
+                if self.debug:
+                    self.logger.debug(f'Skipping completed search {query["query"]}')
+                return res
+            cursor, seen, pages = cp['cursor'] or '', cp['seen'], cp['pages']
+        wm = None
+        if self.watermarks and not cursor and (wm := self.watermarks.get(name, query)):
+            # only fetch what was posted since the last run
+            if query['category'] != 'People':
+                params['variables']['rawQuery'] += f' since_id:{wm["max_id"]}'
+        max_id = wm['max_id'] if wm else 0
         while True:
             if cursor:
                 params['variables']['cursor'] = cursor
-            data, entries, cursor = await self.backoff(lambda: self.get(client, params), **kwargs)
-            res.extend(entries)
-            if len(entries) <= 2 or len(total) >= limit:  # just cursors
-                if self.debug:
-                    self.logger.debug(f'[{GREEN}success{RESET}] Returned {len(total)} search results for {query["query"]}')
+            page = await self.backoff(lambda: self.get(client, params), **kwargs)
+            if isinstance(page, Failure):  # keep the checkpoint so the query can be resumed
+                page.query = query
+                self.failures.append(page)
                 return res
-            total |= set(find_key(entries, 'entryId'))
+            data, entries, cursor = page
+            n = len(entries)
+            stale = False
+            if wm:
+                entries = [e for e in entries if not (_ids := tweet_ids([e])) or _ids[0] > wm['max_id']]
+                stale = len(entries) < n  # reached tweets returned by the last run
+                for e in entries:
+                    e['query'] = query['query']
+            res.extend(entries)
+            # a short page is the last one, but its results (e.g. the few new tweets since the watermark) still count
+            last = n <= 2
+            if not last and len(total if shared is None else shared) + seen >= limit:
+                break
+            # only results count towards `limit`, not cursors or modules
+            ids = user_ids(entries) if query['category'] == 'People' else tweet_ids(entries)
+            total.update(ids)
+            if shared is not None:
+                shared.update(ids)
+            known = False
+            if self.index is not None:
+                _ids = tweet_ids(entries)
+                scope = index_scope(name, query)  # a tweet seen by another search must not stop this one
+                known = self.incremental and bool(_ids) and self.index.known(_ids, scope)
+                self.index.update(_ids, scope)
             if self.debug:
                 self.logger.debug(f'{query["query"]}')
-            if self.save:
-                (out / f'{time.time_ns()}.json').write_bytes(orjson.dumps(entries))
+            if self.save and entries:
+                if self.segments:
+                    self.segments.write(entries, name, query)
+                else:
+                    (out / f'{time.time_ns()}.json').write_bytes(orjson.dumps(entries))
+            if entries or not last:
+                pages += 1
+            max_id = max(max_id, *tweet_ids(entries), 0)
+            if last or known or stale:
+                exhausted = True
+                if self.debug and not last:
+                    self.logger.debug(f'Reached previously crawled tweets for {query["query"]}')
+                break
+            if self.checkpoints:
+                self.checkpoints.save(name, query, cursor, len(total) + seen, pages)
+        if self.debug:
+            self.logger.debug(f'[{GREEN}success{RESET}] Returned {len(total)} search results for {query["query"]}')
+        if self.checkpoints and exhausted:  # stopped at `limit`: keep the cursor, a later run can continue from it
+            self.checkpoints.complete(name, query, len(total) + seen, pages)
+        if self.watermarks and max_id:
+            full = wm['pages'] if wm else pages  # the first crawl of a query is the full-crawl baseline
+            self.watermarks.save(name, query, max_id, full)
+            self.watermark_stats[query['query']] = {
+                'pages': pages,
+                'full_pages': full,
+                'saved_pages': max(full - pages, 0),
+                'new_results': len(total),
+            }
+            if self.debug and wm:
+                self.logger.debug(f'{query["query"]}: fetched {pages} pages since last run, saved {max(full - pages, 0)} of {full}')
+        return res
 
     async def get(self, client: AsyncClient, params: dict) -> tuple:
         _, qid, name = Operation.SearchTimeline
-        r = await client.get(f'https://twitter.com/i/api/graphql/{qid}/{name}', params=build_params(params))
+        url = f'{self.gql_api}/{qid}/{name}'
+        _params = build_params(params)
+        if self.cache and (r := self.cache.get(name, url, qid, _params)):
+            self.metrics.cached(name)
+        elif self.flight is None:
+            r = await self.fetch(client, url, _params)
+        else:
+            # identical pages already in flight, e.g. the same query from two dashboards, share the response
+            r = await self.flight.do(name, params, partial(self.fetch, client, url, _params))
         data = r.json()
-        cursor = self.get_cursor(data)
-        entries = [y for x in find_key(data, 'entries') for y in x if re.search(r'^(tweet|user)-', y['entryId'])]
+        found = find_keys(data, 'entries', 'content', 'entryId')
+        cursor = self.get_cursor(data, found['content'])
+        entries = [y for x in found['entries'] for y in x if re.search(r'^(tweet|user)-', y['entryId'])]
         # add on query info
         for e in entries:
             e['query'] = params['variables']['rawQuery']
-        return data, entries, cursor
+        return data, entries, cursor, found['entryId']
+
+    async def fetch(self, client: AsyncClient, url: str, params: dict) -> CachedResponse:
+        _, qid, name = Operation.SearchTimeline
+        if self.pool:  # accounts taken out of rotation are retried on the next one
+            r = await self.pool.send(client, name, url, self.metrics, params=params)
+        else:
+            start = time.perf_counter()
+            r = await client.get(url, params=params)
+            self.metrics.observe(name, r, time.perf_counter() - start)
+        r.raise_for_status()
+        r = CachedResponse(r)
+        if self.cache:
+            self.cache.set(name, qid, params, r)
+        return r
 
-    def get_cursor(self, data: list[dict]):
-        for e in find_key(data, 'content'):
+    def get_cursor(self, data: list[dict], content: list = None):
+        for e in find_key(data, 'content') if content is None else content:
             if e.get('cursorType') == 'Bottom':
                 return e['value']
 
-    async def backoff(self, fn, **kwargs):
-        retries = kwargs.get('retries', 3)
+    async def backoff(self, fn, **kwargs) -> tuple | Failure:
+        """
+        Call `fn` with retries, see `RetryPolicy`
+
+        @return: (data, entries, cursor), or a `Failure` if the request could not be completed
+        """
+        policy = self.retry_policy
+        retries = kwargs.get('retries', policy.retries)
+        name = Operation.SearchTimeline[-1]
+        breaker = policy.breaker(name)
+        failure = None
         for i in range(retries + 1):
+            if not await breaker.acquire():
+                return Failure(name, 'circuit_open', retry_at=breaker.until)
+            r = None
             try:
-                data, entries, cursor = await fn()
+                data, entries, cursor, ids = await fn()
+            except HTTPStatusError as e:
+                r = e.response
+                failure = Failure(name, 'status', status=r.status_code, error=r.reason_phrase)
+                if not policy.retryable(r):
+                    breaker.success()
+                    return failure
+            except Exception as e:
+                failure = Failure(name, 'exception', error=f'{e!r}')
+            else:
                 if errors := data.get('errors'):
-                    for e in errors:
-                        if self.debug:
+                    breaker.success()
+                    if self.debug:
+                        for e in errors:
                             self.logger.warning(f'{YELLOW}{e.get("message")}{RESET}')
-                        return [], [], ''
-                ids = set(find_key(data, 'entryId'))
-                if len(ids) >= 2:
+                    # the query itself was rejected, end it like an empty result so its checkpoint completes
+                    return data, [], ''
+                if len(set(ids)) >= 2:
+                    breaker.success()
                     return data, entries, cursor
-            except Exception as e:
-                if i == retries:
-                    if self.debug:
-                        self.logger.debug(f'Max retries exceeded\n{e}')
-                    return
-                t = 2 ** i + random.random()
-                if self.debug:
-                    self.logger.debug(f'Retrying in {f"{t:.2f}"} seconds\t\t{e}')
-                await asyncio.sleep(t)
+                failure = Failure(name, 'empty')
+            if (t := policy.delay(i, r)) > policy.max_wait:
+                breaker.failure(until=policy.retry_at(r))
+                failure.retry_at = breaker.until
+                return failure
+            breaker.failure()
+            if i == retries:
+                break
+            if self.debug:
+                self.logger.debug(f'Retrying in {f"{t:.2f}"} seconds\t\t{failure.reason} {failure.status or failure.error or ""}')
+            self.metrics.retry(name)
+            await asyncio.sleep(t)
+        if self.debug:
+            self.logger.debug(f'Max retries exceeded\n{failure}')
+        return failure
 
     def _init_logger(self, **kwargs) -> Logger:
         if kwargs.get('debug'):
+            import logging.config
+
             cfg = kwargs.get('log_config')
             logging.config.dictConfig(cfg or LOG_CONFIG)
 
@@ -0,0 +1,193 @@
+import atexit
+import gzip
+import queue
+import re
+import threading
+import time
+from pathlib import Path
+
+import orjson
+
+from .constants import RED, RESET
+from .util import init_store
+
+
+class SegmentWriter:
+    """
+    Append-only storage for raw pages, replacing one file per response.
+
+    Pages are handed to a background thread that writes them in batches to rotating
+    `segment-NNNNNN.jsonl.gz` files. Every page is its own gzip member, so a segment is a valid
+    gzipped JSONL file and any single page can be read back with one seek. Each page gets a line in
+    `manifest.jsonl` with its segment, offset, length, operation, query and timestamp.
+
+    @param out: output directory
+    @param segment_size: rotate to a new segment once the current one reaches this many bytes
+    @param batch: maximum number of pages written per batch
+    @param interval: maximum seconds a page waits before its batch is written
+    @param level: gzip compression level
+    """
+
+    def __init__(self, out: str | Path, segment_size: int = 64 * 1024 ** 2, batch: int = 256, interval: float = 1.0,
+                 level: int = 6):
+        self.out = Path(out)
+        self.out.mkdir(parents=True, exist_ok=True)
+        self.segment_size = segment_size
+        self.batch = batch
+        self.interval = interval
+        self.level = level
+        self.queue = queue.Queue()
+        self.manifest = open(self.out / 'manifest.jsonl', 'ab')
+        existing = [int(m.group(1)) for p in self.out.glob('segment-*.jsonl.gz') if (m := re.search(r'(\d+)', p.name))]
+        self.index = max(existing, default=0)
+        self.fp = None
+        self.closed = False
+        self.errors = 0  # pages that could not be written
+        self.thread = threading.Thread(target=self._run, name='segment-writer', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write(self, data: any, operation: str, query: dict = None):
+        """
+        Queue a page for writing
+
+        @param data: raw JSON body, or any object serializable by orjson
+        @param operation: operation name
+        @param query: query variables
+        """
+        if self.closed:
+            raise Exception('Segment writer is closed')
+        if not isinstance(data, bytes):
+            data = orjson.dumps(data)
+        self.queue.put((data, operation, query or {}, time.time()))
+
+    def flush(self):
+        """ Block until every queued page is on disk """
+        self.queue.join()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        if self.fp:
+            self.fp.close()
+        self.manifest.close()
+
+    def _segment(self):
+        if self.fp is None or self.fp.tell() >= self.segment_size:
+            if self.fp:
+                self.fp.close()
+            self.index += 1
+            self.fp = open(self.out / f'segment-{self.index:06d}.jsonl.gz', 'ab')
+        return self.fp
+
+    def _run(self):
+        stop = False
+        while not stop:
+            items = [self.queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(items) < self.batch and (t := deadline - time.monotonic()) > 0:
+                try:
+                    items.append(self.queue.get(timeout=t))
+                except queue.Empty:
+                    break
+            if None in items:
+                stop = True
+            pages = [x for x in items if x is not None]
+            try:
+                if pages:
+                    self._write(pages)
+            except Exception as e:
+                # keep the thread alive, `flush` and `close` wait for every queued page
+                self.errors += len(pages)
+                print(f'[{RED}error{RESET}] Failed to write {len(pages)} pages to {self.out}\n{e}')
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+
+    def _write(self, pages: list[tuple]):
+        lines = []
+        for data, operation, query, ts in pages:
+            fp = self._segment()
+            offset = fp.tell()
+            fp.write(gzip.compress(data + b'\n', compresslevel=self.level))
+            lines.append(orjson.dumps({
+                'segment': Path(fp.name).name,
+                'offset': offset,
+                'length': fp.tell() - offset,
+                'operation': operation,
+                'query': query,
+                'time': ts,
+            }, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE))
+        self.fp.flush()
+        # manifest is written after the data, so every manifest line points at a complete page
+        self.manifest.write(b''.join(lines))
+        self.manifest.flush()
+
+
+class SegmentReader:
+    """
+    Random access to pages written by `SegmentWriter`
+
+    e.g.
+        pages = SegmentReader('data/segments')
+        pages[0]
+        [pages.read(r) for r in pages.find(operation='UserTweets', start=time.time() - 3600)]
+    """
+
+    def __init__(self, out: str | Path):
+        self.out = Path(out)
+        self.records = [orjson.loads(line) for line in (self.out / 'manifest.jsonl').read_bytes().splitlines() if line]
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __getitem__(self, i: int) -> any:
+        return self.read(self.records[i])
+
+    def __iter__(self):
+        for r in self.records:
+            yield self.read(r)
+
+    def read(self, record: dict) -> any:
+        with open(self.out / record['segment'], 'rb') as fp:
+            fp.seek(record['offset'])
+            return orjson.loads(gzip.decompress(fp.read(record['length'])))
+
+    def find(self, operation: str = None, query: dict = None, start: float = None, end: float = None) -> list[dict]:
+        """
+        Find manifest records
+
+        @param operation: operation name
+        @param query: query variables, records match if they contain all of these
+        @param start: earliest write time (unix seconds)
+        @param end: latest write time (unix seconds)
+        @return: list of manifest records, pass them to `read`
+        """
+        res = []
+        for r in self.records:
+            if operation and r['operation'] != operation:
+                continue
+            if query and any(r['query'].get(k) != v for k, v in query.items()):
+                continue
+            if (start and r['time'] < start) or (end and r['time'] > end):
+                continue
+            res.append(r)
+        return res
+
+    def segments(self) -> dict[str, dict]:
+        """ Per-segment summary: operations, number of pages and time range """
+        res = {}
+        for r in self.records:
+            s = res.setdefault(r['segment'], {'operations': set(), 'pages': 0, 'start': r['time'], 'end': r['time']})
+            s['operations'].add(r['operation'])
+            s['pages'] += 1
+            s['start'] = min(s['start'], r['time'])
+            s['end'] = max(s['end'], r['time'])
+        return res
+
+
+def init_segments(segments: SegmentWriter | str | Path | bool | None, default: str | Path) -> SegmentWriter | None:
+    return init_store(SegmentWriter, segments, default)
@@ -0,0 +1,194 @@
+import asyncio
+from array import array
+from bisect import bisect_left
+from typing import Generator
+
+from .constants import Operation
+from .retry import Failure
+
+# cursors that lead to more of the conversation: more threads, and more replies within a thread
+BRANCH_CURSORS = {'Bottom', 'ShowMore', 'ShowMoreThreads', 'ShowMoreThreadsPrompt'}
+
+
+def parse_detail(data: dict, tweets: dict[int, dict], cursors: list[str]):
+    """
+    Collect the tweets and branch cursors of a `TweetDetail` page
+
+    @param data: parsed page
+    @param tweets: tweet results by id, updated in place
+    @param cursors: cursor values, appended to
+    """
+    stack = [data]
+    while stack:
+        x = stack.pop()
+        if isinstance(x, list):
+            stack.extend(x)
+            continue
+        if not isinstance(x, dict):
+            continue
+        if 'tweet_results' in x:
+            t = x['tweet_results'].get('result') or {}
+            if t.get('__typename') == 'TweetWithVisibilityResults':
+                t = t['tweet']
+            if t.get('legacy') and t.get('rest_id'):
+                tweets[int(t['rest_id'])] = t
+        if x.get('cursorType') in BRANCH_CURSORS and x.get('value'):
+            cursors.append(x['value'])
+        # tweet results hold no further conversation entries
+        stack.extend(v for k, v in x.items() if k != 'tweet_results' and isinstance(v, (dict, list)))
+
+
+class ConversationTree:
+    """
+    Reply tree of a conversation, indexed by tweet id.
+
+    Tweets are stored in ascending id (i.e. chronological) order: `ids[i]` is the id of `tweets[i]` and
+    `parent[i]` the index of its parent, -1 for the root and for replies whose parent is not available
+    (deleted, protected, or outside the fetched part of the conversation). Children are stored
+    CSR-style: the children of `i` are `child[offsets[i]:offsets[i + 1]]`, oldest first.
+
+    e.g.
+        tree = scraper.thread(1750000000000000000)
+        for depth, tweet in tree.walk():
+            print('  ' * depth + tweet['legacy']['full_text'])
+
+    @param tweets: tweet results by id, tweets from other conversations are dropped
+    @param conversation_id: id of the first tweet of the conversation
+    """
+
+    def __init__(self, tweets: dict[int, dict], conversation_id: int):
+        self.conversation_id = conversation_id
+        tweets = {k: v for k, v in tweets.items() if int(v['legacy'].get('conversation_id_str') or k) == conversation_id}
+        self.ids = array('q', sorted(tweets))
+        self.tweets = [tweets[x] for x in self.ids]
+        index = {x: i for i, x in enumerate(self.ids)}
+        self.parent = array('q', (
+            index.get(int(t['legacy'].get('in_reply_to_status_id_str') or 0), -1) for t in self.tweets
+        ))
+        counts = [0] * (len(self.ids) + 1)
+        for p in self.parent:
+            if p >= 0:
+                counts[p + 1] += 1
+        self.offsets = array('q', counts)
+        for i in range(len(self.ids)):
+            self.offsets[i + 1] += self.offsets[i]
+        self.child = array('q', [0] * (self.offsets[-1] if self.ids else 0))
+        fill = array('q', self.offsets)
+        for i, p in enumerate(self.parent):  # ascending ids, so children end up oldest first
+            if p >= 0:
+                self.child[fill[p]] = i
+                fill[p] += 1
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, tweet_id: int | str) -> bool:
+        i = bisect_left(self.ids, int(tweet_id))
+        return i < len(self.ids) and self.ids[i] == int(tweet_id)
+
+    def __getitem__(self, tweet_id: int | str) -> dict:
+        return self.tweets[self.index(tweet_id)]
+
+    def index(self, tweet_id: int | str) -> int:
+        """ Position of a tweet in `ids`, `tweets` and `parent` """
+        i = bisect_left(self.ids, int(tweet_id))
+        if i == len(self.ids) or self.ids[i] != int(tweet_id):
+            raise KeyError(tweet_id)
+        return i
+
+    def children(self, tweet_id: int | str) -> list[int]:
+        """ Ids of the direct replies to a tweet, oldest first """
+        i = self.index(tweet_id)
+        return [self.ids[c] for c in self.child[self.offsets[i]:self.offsets[i + 1]]]
+
+    def parent_of(self, tweet_id: int | str) -> int | None:
+        p = self.parent[self.index(tweet_id)]
+        return self.ids[p] if p >= 0 else None
+
+    def roots(self) -> list[int]:
+        """ The conversation's first tweet, followed by replies whose parent is missing """
+        return [self.ids[i] for i, p in enumerate(self.parent) if p < 0]
+
+    def depth(self, tweet_id: int | str) -> int:
+        i, d = self.index(tweet_id), 0
+        while (i := self.parent[i]) >= 0:
+            d += 1
+        return d
+
+    def walk(self, tweet_id: int | str = None) -> Generator[tuple[int, dict], None, None]:
+        """
+        Depth-first walk, replies in chronological order
+
+        @param tweet_id: subtree to walk, defaults to every root
+        @return: generator of (depth, tweet)
+        """
+        starts = [self.index(tweet_id)] if tweet_id is not None else [i for i, p in enumerate(self.parent) if p < 0]
+        stack = [(i, 0) for i in reversed(starts)]
+        while stack:
+            i, d = stack.pop()
+            yield d, self.tweets[i]
+            stack.extend((c, d + 1) for c in reversed(self.child[self.offsets[i]:self.offsets[i + 1]]))
+
+    def missing(self) -> list[int]:
+        """ Ids of tweets with more replies counted than present in the tree """
+        return [
+            self.ids[i] for i, t in enumerate(self.tweets)
+            if t['legacy'].get('reply_count', 0) > self.offsets[i + 1] - self.offsets[i]
+        ]
+
+
+async def fetch_thread(scraper, client, tweet_id: int, max_requests: int = 500, concurrency: int = 8) -> ConversationTree:
+    """
+    Fetch a whole conversation with `TweetDetail` and build its tree
+
+    The conversation of `tweet_id` is fetched, then every branch cursor it contains (more threads, more
+    replies in a thread), concurrently. Once no cursors are left, tweets that still have more replies than
+    were returned are fetched as focal tweets to reach deeper branches. Tweets and cursors already fetched
+    are never requested again.
+
+    @param scraper: `Scraper` used for the requests
+    @param client: client from `scraper._get_client()`
+    @param tweet_id: any tweet of the conversation
+    @param max_requests: maximum number of `TweetDetail` requests
+    @param concurrency: requests in flight at once
+    @return: conversation tree
+    """
+    tweets = {}
+    cursors = set()
+    expanded = {tweet_id}
+    sem = asyncio.Semaphore(concurrency)
+
+    async def fetch(focal: int, cursor: str = None) -> list[tuple[int, str]]:
+        async with sem:
+            r = await scraper._query(client, Operation.TweetDetail, focalTweetId=focal, **({'cursor': cursor} if cursor else {}))
+        if isinstance(r, Failure):
+            scraper._failed(r)
+            return []
+        found = []
+        try:
+            parse_detail(r.json(), tweets, found)
+        except Exception as e:  # one bad page must not lose the branches that were fetched
+            scraper._failed(Failure(Operation.TweetDetail[-1], 'exception', error=f'{e!r}',
+                                    query={'focalTweetId': focal, **({'cursor': cursor} if cursor else {})}))
+            return []
+        return [(focal, c) for c in found]
+
+    pending = [(tweet_id, None)]
+    requests = 0
+    while pending and requests < max_requests:
+        batch, pending = pending[:max_requests - requests], pending[max_requests - requests:]
+        requests += len(batch)
+        for focal, cursor in (x for page in await asyncio.gather(*(fetch(*b) for b in batch)) for x in page):
+            if cursor not in cursors:
+                cursors.add(cursor)
+                pending.append((focal, cursor))
+        if not pending and (root := tweets.get(tweet_id)):
+            # deeper branches than the pages showed
+            tree = ConversationTree(tweets, int(root['legacy']['conversation_id_str']))
+            pending = [(x, None) for x in tree.missing() if x not in expanded]
+            expanded.update(x for x, _ in pending)
+    if scraper.debug:
+        scraper.logger.debug(f'Conversation of {tweet_id}: {len(tweets)} tweets in {requests} requests')
+    if not (root := tweets.get(tweet_id)):
+        return ConversationTree({}, tweet_id)
+    return ConversationTree(tweets, int(root['legacy']['conversation_id_str']))
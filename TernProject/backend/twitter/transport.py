@@ -0,0 +1,137 @@
+import asyncio
+import importlib.util
+from urllib.parse import urlsplit
+
+from httpx import AsyncBaseTransport, AsyncByteStream, AsyncHTTPTransport, Limits, Request, Response
+
+from .constants import MAX_ENDPOINT_LIMIT
+
+# httpcore trace events counted in `GraphQLTransport.stats`
+HANDSHAKES = {
+    'connection.connect_tcp.complete': 'tcp',
+    'connection.start_tls.complete': 'tls',
+    'http2.send_connection_init.complete': 'http2',
+}
+
+
+class _Stream(AsyncByteStream):
+    """ Response body that frees its stream slot once closed """
+
+    def __init__(self, stream: AsyncByteStream, done):
+        self.stream = stream
+        self.done = done
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            self.done()
+
+
+class GraphQLTransport(AsyncBaseTransport):
+    """
+    Transport for GraphQL traffic to a single host.
+
+    With HTTP/2, requests are multiplexed over `connections` connections, each carrying at most `streams`
+    requests at once (the server's SETTINGS_MAX_CONCURRENT_STREAMS still applies). httpcore sends every
+    request to the first usable HTTP/2 connection, so each connection gets its own pool and requests go
+    to the one with the fewest streams in flight.
+
+    With HTTP/1.1 it is a single pool of up to `connections` connections, one request each.
+
+    TCP, TLS and HTTP/2 handshakes are counted in `stats` from httpcore trace events.
+
+    @param http2: multiplex over HTTP/2
+    @param connections: number of connections
+    @param streams: requests in flight per HTTP/2 connection
+    @param http1: allow HTTP/1.1, `False` uses HTTP/2 prior knowledge (cleartext servers)
+    @param kwargs: passed to `httpx.AsyncHTTPTransport`, e.g. `verify`
+    """
+
+    def __init__(self, http2: bool = True, connections: int = None, streams: int = 100, http1: bool = True, **kwargs):
+        self.http2 = http2
+        if http2:
+            connections = connections or 2
+            limits = Limits(max_connections=1, max_keepalive_connections=1)
+            self.pools = [AsyncHTTPTransport(http2=True, http1=http1, limits=limits, **kwargs) for _ in range(connections)]
+            self.slots = [asyncio.Semaphore(streams) for _ in range(connections)]
+        else:
+            connections = connections or MAX_ENDPOINT_LIMIT
+            self.pools = [AsyncHTTPTransport(limits=Limits(max_connections=connections), **kwargs)]
+            self.slots = None
+        self.inflight = [0] * len(self.pools)
+        self.stats = {'requests': 0, 'tcp': 0, 'tls': 0, 'http2': 0}
+
+    async def handle_async_request(self, request: Request) -> Response:
+        i = min(range(len(self.pools)), key=self.inflight.__getitem__)
+        self.inflight[i] += 1
+        self.stats['requests'] += 1
+        slot = self.slots[i] if self.slots else None
+        done = False
+
+        def release():
+            nonlocal done
+            if not done:
+                done = True
+                self.inflight[i] -= 1
+                if slot:
+                    slot.release()
+
+        request.extensions = {**request.extensions, 'trace': self._trace(request.extensions.get('trace'))}
+        try:
+            if slot:
+                await slot.acquire()
+        except BaseException:
+            slot = None
+            release()
+            raise
+        try:
+            r = await self.pools[i].handle_async_request(request)
+        except BaseException:
+            release()
+            raise
+        return Response(r.status_code, headers=r.headers, stream=_Stream(r.stream, release), extensions=r.extensions)
+
+    def _trace(self, trace):
+        async def _trace(event: str, info: dict):
+            if key := HANDSHAKES.get(event):
+                self.stats[key] += 1
+            if trace is not None:
+                await trace(event, info)
+
+        return _trace
+
+    async def warmup(self, url: str, n: int = None):
+        """
+        Open connections ahead of the first burst of requests
+
+        @param url: any URL on the GraphQL host, the response is discarded
+        @param n: connections to open over HTTP/1.1, defaults to 1. Every connection is opened over HTTP/2.
+        """
+
+        async def ping(pool: AsyncHTTPTransport):
+            r = await pool.handle_async_request(Request('HEAD', url, extensions={'trace': self._trace(None)}))
+            await r.aread()
+            await r.aclose()
+
+        pools = self.pools if self.http2 else self.pools * (n or 1)
+        await asyncio.gather(*(ping(p) for p in pools), return_exceptions=True)
+
+    async def aclose(self):
+        await asyncio.gather(*(p.aclose() for p in self.pools))
+
+
+def init_http2(http2: bool | None) -> bool:
+    """ HTTP/2 is used when `h2` is installed, unless disabled with `http2=False` """
+    if http2 is None:
+        return importlib.util.find_spec('h2') is not None
+    return http2
+
+
+def init_transport(url: str, http2: bool, http1: bool = True, **kwargs) -> GraphQLTransport:
+    """ HTTP/2 needs TLS (ALPN) or prior knowledge (`http1=False`), a cleartext host otherwise gets HTTP/1.1 """
+    return GraphQLTransport(http2 and (urlsplit(url).scheme == 'https' or not http1), http1=http1, **kwargs)
@@ -0,0 +1,117 @@
+import time
+import zlib
+from pathlib import Path
+
+import orjson
+
+from .constants import CACHE_TTL
+from .util import connect_db, find_key, init_store
+
+
+def is_screen_name(user: int | str) -> bool:
+    """ Screen names are strings that are not all digits. Prefix an all-digit screen name with `@`. """
+    return isinstance(user, str) and (user.startswith('@') or not user.isdigit())
+
+
+def users_in(data: dict | list) -> list[dict]:
+    """ User results found anywhere in a response """
+    return [
+        x for x in find_key(data, 'result')
+        if isinstance(x, dict) and x.get('__typename') == 'User' and x.get('rest_id') and x.get('legacy', {}).get('screen_name')
+    ]
+
+
+class UserCache:
+    """
+    Persistent screen_name -> rest_id and rest_id -> profile cache.
+
+    Every user result seen is stored with the time it was fetched. Lookups older than `ttl` are misses,
+    so renamed accounts are picked up again. Screen names are matched case-insensitively, as on Twitter.
+
+    @param path: sqlite database path, None keeps the cache in memory for the lifetime of the scraper
+    @param ttl: seconds before an entry has to be fetched again
+    """
+
+    def __init__(self, path: str | Path | None = 'data/users.db', ttl: int = CACHE_TTL['UserByScreenName']):
+        self.path = Path(path) if path else None
+        if self.path:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.db = connect_db(self.path)
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                rest_id INTEGER PRIMARY KEY,
+                screen_name TEXT NOT NULL,
+                profile BLOB NOT NULL,
+                updated REAL NOT NULL
+            )
+        ''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS users_screen_name ON users (screen_name)')
+
+    def ids(self, screen_names: list[str]) -> dict[str, int]:
+        """
+        Look up user ids
+
+        @param screen_names: screen names, with or without `@`
+        @return: screen name (as given) -> user id, for fresh entries only
+        """
+        names = {x: x.lstrip('@').lower() for x in screen_names}
+        found = {}
+        unique = list(set(names.values()))
+        for i in range(0, len(unique), 500):  # sqlite's variable limit
+            chunk = unique[i:i + 500]
+            found |= dict(self.db.execute(
+                f'SELECT screen_name, rest_id FROM users WHERE updated > ? AND screen_name IN ({",".join("?" * len(chunk))})',
+                (time.time() - self.ttl, *chunk)).fetchall())
+        out = {x: found[name] for x, name in names.items() if name in found}
+        self.hits += len(out)
+        self.misses += len(names) - len(out)
+        return out
+
+    def profiles(self, user_ids: list[int]) -> dict[int, dict]:
+        """
+        Look up user results
+
+        @param user_ids: user ids
+        @return: user id -> user result, for fresh entries only
+        """
+        unique = list({int(x) for x in user_ids})
+        out = {}
+        for i in range(0, len(unique), 500):
+            chunk = unique[i:i + 500]
+            rows = self.db.execute(
+                f'SELECT rest_id, profile FROM users WHERE updated > ? AND rest_id IN ({",".join("?" * len(chunk))})',
+                (time.time() - self.ttl, *chunk)).fetchall()
+            out |= {k: orjson.loads(zlib.decompress(v)) for k, v in rows}
+        self.hits += len(out)
+        self.misses += len(unique) - len(out)
+        return out
+
+    def set(self, users: list[dict]):
+        """ Store user results, e.g. from `users_in` """
+        now = time.time()
+        self.db.executemany(
+            'INSERT OR REPLACE INTO users (rest_id, screen_name, profile, updated) VALUES (?, ?, ?, ?)',
+            ((int(u['rest_id']), u['legacy']['screen_name'].lower(), zlib.compress(orjson.dumps(u), 1), now) for u in users)
+        )
+
+    def clear(self):
+        self.db.execute('DELETE FROM users')
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0,
+            'entries': self.db.execute('SELECT COUNT(*) FROM users').fetchone()[0],
+        }
+
+    def close(self):
+        self.db.close()
+
+
+def init_user_cache(cache: UserCache | str | Path | bool | None, default: str | Path) -> UserCache | None:
+    return init_store(UserCache, cache, default)
@@ -1,17 +1,80 @@
+import asyncio
+import importlib
 import random
 import re
+import sys
 import time
+from functools import lru_cache
 from logging import Logger
 from pathlib import Path
 from urllib.parse import urlsplit, urlencode, urlunsplit, parse_qs, quote
 
-import aiofiles
 import orjson
-from aiofiles.os import makedirs
-from httpx import Response, Client
+from httpx import AsyncClient, Response, Client
 from textwrap import dedent
+from typing import Callable
 
-from .constants import GREEN, MAGENTA, RED, RESET, MAX_GQL_CHAR_LIMIT, USER_AGENTS, ORANGE
+from .constants import GREEN, MAGENTA, RED, RESET, MAX_GQL_CHAR_LIMIT, USER_AGENTS, ORANGE, FEATURE_PROFILES, Operation
+from .transport import init_transport
+
+
+class LazyImport:
+    """
+    Stand-in for an optional dependency, imported on first use instead of when the package is imported
+
+    e.g.
+        tqdm_asyncio = LazyImport('tqdm.asyncio', 'tqdm_asyncio')
+    """
+    __slots__ = ('_module', '_attr', '_obj')
+
+    def __init__(self, module: str, attr: str = None):
+        self._module = module
+        self._attr = attr
+        self._obj = None
+
+    def _load(self) -> any:
+        if self._obj is None:
+            obj = importlib.import_module(self._module)
+            self._obj = getattr(obj, self._attr) if self._attr else obj
+        return self._obj
+
+    def __getattr__(self, name: str) -> any:
+        obj = self._load()
+        try:
+            return getattr(obj, name)
+        except AttributeError:
+            if self._attr:
+                raise
+            # submodules that are not imported by the package itself
+            return importlib.import_module(f'{self._module}.{name}')
+
+    def __call__(self, *args, **kwargs) -> any:
+        return self._load()(*args, **kwargs)
+
+
+aiofiles = LazyImport('aiofiles')
+
+
+@lru_cache
+def init_event_loop():
+    """
+    Notebook and uvloop setup. Done once, when the first client is created, instead of on import
+    """
+    try:
+        if get_ipython().__class__.__name__ == 'ZMQInteractiveShell':
+            import nest_asyncio
+
+            nest_asyncio.apply()
+    except:
+        ...
+
+    if sys.platform != 'win32':
+        try:
+            import uvloop
+
+            uvloop.install()
+        except ImportError as e:
+            ...
 
 
 def init_session():
@@ -42,13 +105,180 @@ def batch_ids(ids: list[int | str], char_limit: int = MAX_GQL_CHAR_LIMIT) -> lis
     return res
 
 
+def connect_db(path: str | Path | None):
+    """
+    Open an sqlite database for the stores and crawlers: autocommit, usable from any thread, WAL journal
+
+    @param path: database path, None opens an in-memory database
+    @return: sqlite3 connection
+    """
+    import sqlite3
+
+    db = sqlite3.connect(path or ':memory:', isolation_level=None, check_same_thread=False)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    return db
+
+
+def init_store(cls: type, value: any, default: str | Path) -> any:
+    """
+    Build an opt-in store (cache, checkpoints, index, ...) from its keyword argument
+
+    @param cls: store class, called with a path
+    @param value: an instance of `cls`, a path, `True` for `default`, or a falsy value to disable it
+    @param default: path used for `True`
+    @return: the store, or None when disabled
+    """
+    if isinstance(value, cls):  # checked first, an empty store can be falsy
+        return value
+    if not value:
+        return None
+    return cls(default if value is True else value)
+
+
+class ClientMixin:
+    """
+    Shared `AsyncClient` plumbing for `Scraper` and `Search`.
+
+    Sync calls run on one persistent event loop per instance (`_sync`), so the client and its connections
+    survive between calls. Async callers get a client bound to their running loop, a client left on another
+    loop is closed on that loop before it is replaced.
+    """
+    _client = _client_loop = _loop = None
+    transport = None
+
+    def _client_options(self) -> dict:
+        """ `AsyncClient` arguments besides the transport """
+        return {'headers': get_headers(self.session)}
+
+    def _sync(self, coro):
+        """ Run a coroutine on this instance's event loop, so the shared client survives between sync calls """
+        if self._loop is None or self._loop.is_closed():
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(coro)
+
+    async def _get_client(self) -> AsyncClient:
+        """ Long-lived client shared by all GraphQL requests made from the current event loop """
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._client_loop is not loop:
+            await self._close_client()
+            self.transport = init_transport(self.gql_api, self.http2, self.http1, connections=self.connections, streams=self.streams)
+            self._client = AsyncClient(transport=self.transport, **self._client_options())
+            self._client_loop = loop
+        return self._client
+
+    async def _close_client(self):
+        """ Close the shared client on the loop it was created on, its connections are bound to that loop """
+        client, loop = self._client, self._client_loop
+        self._client = None
+        if client is None or client.is_closed:
+            return
+        try:
+            if loop is None or loop is asyncio.get_running_loop():
+                await client.aclose()
+            elif loop.is_running():  # used from another thread
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(client.aclose(), loop))
+            elif not loop.is_closed():
+                await asyncio.to_thread(loop.run_until_complete, client.aclose())
+            else:
+                await client.aclose()  # best effort, the loop's sockets may already be gone
+        except Exception as e:
+            if self.debug:
+                self.logger.debug(f'Failed to close the previous client\n{e}')
+
+    def warmup(self, connections: int = None):
+        """
+        Open the GraphQL connections before the first requests, so a burst of queries doesn't queue behind
+        TCP/TLS handshakes. With HTTP/2 every connection is opened.
+
+        @param connections: connections to open over HTTP/1.1, defaults to 1
+        """
+        return self._sync(self.awarmup(connections))
+
+    async def awarmup(self, connections: int = None):
+        """ Async version of `warmup` """
+        await self._get_client()
+        await self.transport.warmup(self.gql_api, connections)
+
+    async def aclose(self):
+        """ Close the shared client and flush pending segment writes """
+        await self._close_client()
+        if self.segments:
+            await asyncio.to_thread(self.segments.flush)
+        if self.index is not None:
+            self.index.save()
+
+    def close(self):
+        """ Close the shared client, the segment writer and the event loop used by the sync API """
+        if self._client is not None and self._client_loop is self._loop:
+            self._sync(self.aclose())
+        if self.segments:
+            self.segments.close()
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class CachedResponse:
+    """
+    `httpx.Response` proxy that decodes the body once
+
+    The body is parsed with orjson on the first call to `json()` and the result is reused by the
+    save, log and return paths. Everything else is delegated to the wrapped response.
+    """
+    __slots__ = ('response', '_data')
+
+    def __init__(self, response: Response):
+        self.response = response
+        self._data = None
+
+    def json(self) -> any:
+        if self._data is None:
+            self._data = orjson.loads(self.response.content)
+        return self._data
+
+    def __getattr__(self, name: str) -> any:
+        return getattr(self.response, name)
+
+
 def build_params(params: dict) -> dict:
     return {k: orjson.dumps(v).decode() for k, v in params.items()}
 
 
-async def save_json(r: Response, path: str | Path, name: str, **kwargs):
+def get_features(profile: str | dict | None, operation: str = None) -> dict:
+    """
+    Resolve a feature profile to the `features` sent with a GraphQL request
+
+    @param profile: a name in `FEATURE_PROFILES`, a dict of flag overrides, or a dict of operation name -> profile
+        (operations not listed get `full`). `None` is `full`.
+    @param operation: operation name, used to pick the profile from a per-operation dict
+    @return: features dict
+    """
+    if profile is None:
+        return Operation.default_features
+    if isinstance(profile, dict):
+        if profile.keys() <= Operation.default_features.keys():
+            return Operation.default_features | profile
+        return get_features(profile.get(operation), operation)
+    if profile not in FEATURE_PROFILES:
+        raise Exception(f'Unknown feature profile {profile!r}, expected one of {list(FEATURE_PROFILES)}')
+    return Operation.default_features | FEATURE_PROFILES[profile]
+
+
+async def save_json(r: Response | CachedResponse, path: str | Path, name: str, **kwargs):
     try:
-        data = r.json()
+        r.json()  # only save valid JSON, free if already decoded
         kwargs.pop('cursor', None)
 
         # special case: only 2 endpoints have batch requests as of Dec 2023
@@ -56,9 +286,9 @@ async def save_json(r: Response, path: str | Path, name: str, **kwargs):
             out = f'{path}/batch'
         else:
             out = f'{path}/{"_".join(map(str, kwargs.values()))}'
-        await makedirs(out, exist_ok=True)
+        await aiofiles.os.makedirs(out, exist_ok=True)
         async with aiofiles.open(f'{out}/{time.time_ns()}_{name}.json', 'wb') as fp:
-            await fp.write(orjson.dumps(data))
+            await fp.write(r.content)
 
     except Exception as e:
         print(f'Failed to save JSON data for {kwargs}\n{e}')
@@ -104,11 +334,12 @@ def set_qs(url: str, qs: dict, update=False, **kwargs) -> str:
                                      safe=kwargs.get('safe', '')), f))
 
 
-def get_cursor(data: list | dict) -> str:
-    # inefficient, but need to deal with arbitrary schema
-    entries = find_key(data, 'entries')
+def get_cursor(data: list | dict, entries: list = None) -> str:
+    # need to deal with arbitrary schema, pass `entries` if they were already extracted
+    if entries is None:
+        entries = find_key(data, 'entries')
     if entries:
-        for entry in entries.pop():
+        for entry in entries[-1]:
             entry_id = entry.get('entryId', '')
             if ('cursor-bottom' in entry_id) or ('cursor-showmorethreads' in entry_id):
                 content = entry['content']
@@ -149,34 +380,82 @@ def find_key(obj: any, key: str) -> list:
     Most data of interest is nested, and sometimes defined by different schemas.
     It is not worth our time to enumerate all absolute paths to a given key, then update
     the paths in our parsing functions every time Twitter changes their API.
-    Instead, we recursively search for the key here, then run post-processing functions on the results.
+    Instead, we search for the key here, then run post-processing functions on the results.
 
     @param obj: dictionary or list of dictionaries
     @param key: key to search for
     @return: list of values
     """
+    return find_keys(obj, key)[key]
+
+
+def find_keys(obj: any, *keys: str, paths: dict = None) -> dict[str, list]:
+    """
+    Find all values of several keys within a nested dict or list of dicts in a single pass
+
+    Same results as calling `find_key` once per key, but the tree is only walked once,
+    iteratively, without building intermediate lists at every level.
+
+    Keys with a known location can be given in `paths` (see `compile_path`). If the path resolves,
+    its values are used and the key is skipped during the walk, otherwise it falls back to the generic walk.
+
+    @param obj: dictionary or list of dictionaries
+    @param keys: keys to search for
+    @param paths: optional mapping of key -> dotted path, e.g. {'entries': 'data.timeline.instructions.*.entries'}
+    @return: dict of key -> list of values
+    """
+    res = {k: [] for k in keys}
+    if paths:
+        for k, path in paths.items():
+            if k in res and (values := compile_path(path)(obj)):
+                res[k] = values
+        keys = tuple(k for k in keys if not res[k])
+        if not keys:
+            return res
+
+    stack = [obj]
+    pop, push = stack.pop, stack.extend
+    while stack:
+        o = pop()
+        if not o:
+            continue
+        if isinstance(o, dict):
+            for k in keys:
+                if v := o.get(k):
+                    res[k].append(v)
+            push(reversed(o.values()))
+        elif isinstance(o, list):
+            push(reversed(o))
+    return res
+
 
-    def helper(obj: any, key: str, L: list) -> list:
-        if not obj:
-            return L
+@lru_cache(maxsize=None)
+def compile_path(path: str) -> Callable[[any], list]:
+    """
+    Compile a dotted path into a getter for a known schema
 
-        if isinstance(obj, list):
-            for e in obj:
-                L.extend(helper(e, key, []))
-            return L
+    `*` matches every element of a list, e.g. `data.timeline.instructions.*.entries`.
 
-        if isinstance(obj, dict) and obj.get(key):
-            L.append(obj[key])
+    @param path: dotted path
+    @return: function returning the list of (truthy) values found at `path`, empty if the schema does not match
+    """
+    parts = tuple(path.split('.'))
 
-        if isinstance(obj, dict) and obj:
-            for k in obj:
-                L.extend(helper(obj[k], key, []))
-        return L
+    def get(obj: any) -> list:
+        nodes = [obj]
+        for p in parts:
+            if p == '*':
+                nodes = [x for n in nodes if isinstance(n, list) for x in n]
+            else:
+                nodes = [n[p] for n in nodes if isinstance(n, dict) and p in n]
+            if not nodes:
+                return nodes
+        return [n for n in nodes if n]
 
-    return helper(obj, key, [])
+    return get
 
 
-def log(logger: Logger, level: int, r: Response):
+def log(logger: Logger, level: int, r: Response | CachedResponse):
     def stat(r, txt, data):
         if level >= 1:
             logger.debug(f'{r.url.path}')
@@ -200,8 +479,10 @@ def log(logger: Logger, level: int, r: Response):
 
     try:
         status = r.status_code
-        txt, data, = r.text, r.json()
+        # only decode what the log level needs, `CachedResponse.json()` is free after the first call
+        txt = r.text if level >= 3 else ''
         if 'json' in r.headers.get('content-type', ''):
+            data = r.json()
             if data.get('errors') and not find_key(data, 'instructions'):
                 logger.error(f'[{RED}error{RESET}] {status} {data}')
             else: